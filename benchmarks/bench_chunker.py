@@ -0,0 +1,57 @@
+"""Микробенчмарк чанкера сводок.
+
+Запуск из корня проекта:
+    python benchmarks/bench_chunker.py --messages 100000
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "bot"))
+
+from chunker import estimate_tokens, iter_chunks, token_budget  # noqa: E402
+
+WORDS = "новости рынок курс заявление министерство компания рост снижение данные отчёт".split()
+
+
+def make_messages(count: int, seed: int = 42) -> list[str]:
+    rnd = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        # Изредка попадаются очень длинные посты, которые придётся резать
+        sentences = rnd.randint(200, 400) if rnd.random() < 0.01 else rnd.randint(1, 6)
+        messages.append(" ".join(
+            " ".join(rnd.choices(WORDS, k=rnd.randint(5, 15))).capitalize() + "."
+            for _ in range(sentences)
+        ))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--budget", type=int, default=token_budget("GigaChat", ""))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    total_chars = sum(len(m) for m in messages)
+
+    timings = []
+    chunks = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        chunks = list(iter_chunks(messages, args.budget))
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    over_budget = sum(1 for c in chunks if estimate_tokens(c) > args.budget)
+    print(f"сообщений: {len(messages)}, символов: {total_chars}, бюджет: {args.budget} ток.")
+    print(f"чанков: {len(chunks)}, превышают бюджет: {over_budget}")
+    print(f"лучшее время: {best * 1000:.1f} мс, {total_chars / best / 1e6:.1f} млн символов/с")
+
+
+if __name__ == "__main__":
+    main()
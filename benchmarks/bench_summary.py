@@ -0,0 +1,134 @@
+"""Бенчмарк построения сводок: summarize_messages против локальной заглушки GigaChat
+(benchmarks/gigachat_stub.py) с заданной задержкой и долей ошибок.
+
+Запуск из корня проекта:
+    python benchmarks/bench_summary.py --summaries 20 --messages 3000 --latency 0.3 --error-rate 0.05
+    python benchmarks/bench_summary.py --stream  # финальный шаг потоком: время до первого фрагмента
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from common import latency_summary, report  # noqa: E402
+from gigachat_stub import StubState, start_stub  # noqa: E402
+
+WORDS = ("новости рынок курс заявление министерство компания рост снижение данные отчёт "
+         "банк ставка прогноз выручка акции регион правительство решение проект запуск").split()
+
+
+def make_batch(count: int, rnd: random.Random) -> list[str]:
+    return [
+        " ".join(rnd.choices(WORDS, k=rnd.randint(15, 120))).capitalize() + "."
+        for _ in range(count)
+    ]
+
+
+async def run(args):
+    workdir = Path(tempfile.mkdtemp(prefix="bench_summary_"))
+    base_url = f"http://127.0.0.1:{args.port}"
+    # Настройки читаются модулями бота при импорте, поэтому задаём их до импорта
+    os.environ.update({
+        "GIGACHAT_OAUTH_URL": f"{base_url}/api/v2/oauth",
+        "GIGACHAT_CHAT_URL": f"{base_url}/api/v1/chat/completions",
+        "CLIENT_ID": os.getenv("CLIENT_ID") or "bench",
+        "CLIENT_SECRET": os.getenv("CLIENT_SECRET") or "bench",
+        "SUMMARY_CACHE_PATH": str(workdir / "summary_cache.db"),
+        "SUMMARY_MAX_CONCURRENCY": str(args.max_concurrency),
+        "SUMMARY_MAX_RPS": str(args.max_rps),
+    })
+
+    import gigachat
+    from summary_service import summarize_messages
+
+    # Ошибки, внесённые заглушкой, учитываются её счётчиками — в логе они только мешают
+    logging.getLogger("gigachat").setLevel(logging.CRITICAL)
+
+    state = StubState(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, chunk_delay=0.0,
+    )
+    runner = await start_stub(port=args.port, state=state)
+
+    rnd = random.Random(42)
+    batches = [make_batch(args.messages, rnd) for _ in range(args.summaries)]
+    semaphore = asyncio.Semaphore(args.parallel)
+    latencies = []
+    first_fragment = []
+    failures = 0
+
+    async def one(batch):
+        nonlocal failures
+        async with semaphore:
+            t0 = time.perf_counter()
+            first_seen = False
+
+            # Финальный шаг идёт потоком, как у /summary_now в боте
+            async def on_progress(text):
+                nonlocal first_seen
+                if not first_seen:
+                    first_seen = True
+                    first_fragment.append(time.perf_counter() - t0)
+
+            try:
+                await summarize_messages(batch, on_progress=on_progress if args.stream else None)
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(one(batch) for batch in batches))
+    finally:
+        elapsed = time.perf_counter() - started
+        retries = gigachat.get_client().retries
+        await gigachat.close_client()
+        await runner.cleanup()
+
+    report(
+        "summary",
+        {
+            "summaries": args.summaries, "messages": args.messages, "parallel": args.parallel,
+            "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate, "stream": args.stream,
+            "max_concurrency": args.max_concurrency, "max_rps": args.max_rps,
+        },
+        {
+            "summaries_per_sec": len(batches) / elapsed,
+            "messages_per_sec": len(batches) * args.messages / elapsed,
+            "failed_summaries": failures,
+            "gigachat_retries": retries,
+            "summary_latency": latency_summary(latencies),
+            "first_fragment_latency": latency_summary(first_fragment) if first_fragment else None,
+            "stub_requests": dict(state.counters),
+        },
+        args.json,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--summaries", type=int, default=10, help="сколько сводок построить")
+    parser.add_argument("--messages", type=int, default=2000, help="сообщений в одной сводке")
+    parser.add_argument("--parallel", type=int, default=2, help="сводок одновременно")
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка заглушки, с")
+    parser.add_argument("--jitter", type=float, default=0.05, help="разброс задержки, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--stream", action="store_true", help="финальный шаг сводки — потоком (on_progress)")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="SUMMARY_MAX_CONCURRENCY")
+    parser.add_argument("--max-rps", type=float, default=0, help="SUMMARY_MAX_RPS (0 — без ограничения)")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--json", help="дописать результат в JSONL-файл")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
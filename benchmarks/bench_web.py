@@ -0,0 +1,204 @@
+"""Нагрузочный бенчмарк панели: маршруты Flask под Hypercorn на заранее заполненной большой БД.
+
+Запуск из корня проекта:
+    python benchmarks/bench_web.py --rows 2000000 --db /tmp/bench_web.db   # первый запуск заполняет БД
+    python benchmarks/bench_web.py --db /tmp/bench_web.db --duration 10 --concurrency 16
+    python benchmarks/bench_web.py --db /tmp/bench_web.db --no-cache   # каждая страница отрисовывается заново
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from common import latency_summary, report  # noqa: E402
+
+WORDS = ("новости рынок курс заявление министерство компания рост снижение данные отчёт "
+         "банк ставка прогноз выручка акции регион правительство решение проект запуск").split()
+# Редкие темы: каждая встречается примерно в одном сообщении из восьмисот, как обычное слово в живом канале
+TOPICS = ("биткоин нефть газ зерно металлы уголь золото серебро платина медь алюминий никель "
+          "ипотека вклады облигации дивиденды инфляция безработица экспорт импорт санкции пошлины "
+          "бюджет налоги пенсии зарплаты туризм авиаперевозки железная дорога порты логистика "
+          "электроэнергия связь спутники роботы микросхемы смартфоны автомобили лекарства вакцины").split()
+
+ROUTES = [
+    "/messages",
+    "/messages?channel=1",
+    "/messages?from=2024-01-10&to=2024-01-20",
+    "/api/messages?limit=100&summarized=0",
+    "/summary",
+    "/api/summaries?channel=2",
+    # Слово из большинства сообщений (худший случай) и редкая тема
+    "/search?q=ставка+прогноз",
+    "/search?q=дивиденды",
+    "/api/search?q=выручка&scope=messages",
+    "/channels",
+]
+
+
+async def populate(path: Path, rows: int, channels: int):
+    """Заполняет БД синтетическими сообщениями и сводками (схема — из Database.init_db)."""
+    from tg_listener.db import Database
+
+    db = Database(f"sqlite+aiosqlite:///{path}")
+    await db.init_db()
+    for i in range(1, channels + 1):
+        channel = await db.add_channel(username=f"bench{i}", title=f"Bench {i}")
+        await db.set_channel_monitored(channel.id, True)
+    await db.engine.dispose()
+
+    print(f"⏳ Заполняем {path}: {rows} сообщений...")
+    rnd = random.Random(42)
+    started_at = datetime.datetime(2024, 1, 1)
+    step = datetime.timedelta(days=90) / rows
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    t0 = time.perf_counter()
+    batch = 50_000
+    for offset in range(0, rows, batch):
+        conn.executemany(
+            "INSERT INTO messages (msg_id, chat_id, sender, text, date, is_summarized, is_duplicate) "
+            "VALUES (?, ?, ?, ?, ?, 0, 0)",
+            [
+                (
+                    i, rnd.randint(1, channels), str(rnd.randint(1, 10_000)),
+                    " ".join(rnd.choices(WORDS, k=rnd.randint(10, 60))).capitalize()
+                    + (f" {rnd.choice(TOPICS)}." if rnd.random() < 0.05 else "."),
+                    (started_at + step * i).isoformat(sep=" "),
+                )
+                for i in range(offset, min(offset + batch, rows))
+            ]
+        )
+        conn.commit()
+        print(f"  {min(offset + batch, rows)} / {rows}", end="\r")
+
+    # Сводки по каждому каналу и водяные знаки на середине истории
+    conn.executemany(
+        "INSERT INTO summaries (channel_id, created_at, range_start, range_end, content) VALUES (?, ?, ?, ?, ?)",
+        [
+            (
+                rnd.randint(1, channels), (started_at + datetime.timedelta(hours=h)).isoformat(sep=" "),
+                None, None, " ".join(rnd.choices(WORDS, k=60)).capitalize() + "."
+            )
+            for h in range(0, 90 * 24, 2)
+        ]
+    )
+    conn.execute(
+        "UPDATE channels SET summary_watermark = "
+        "(SELECT COALESCE(MAX(id), 0) / 2 FROM messages WHERE messages.chat_id = channels.id)"
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    print(f"\n✅ БД заполнена за {time.perf_counter() - t0:.1f} с")
+
+    db = Database(f"sqlite+aiosqlite:///{path}")
+    await db.reconcile_stats()
+    await db.engine.dispose()
+
+
+async def load(base_url: str, route: str, duration: float, concurrency: int):
+    import aiohttp
+
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async with aiohttp.ClientSession() as session:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                try:
+                    async with session.get(base_url + route) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - t0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {"rps": len(latencies) / elapsed, "errors": errors, **latency_summary(latencies)}
+
+
+async def run(args):
+    db_path = Path(args.db) if args.db else Path(tempfile.mkdtemp(prefix="bench_web_")) / "bench.db"
+    if not db_path.exists():
+        await populate(db_path, args.rows, args.channels)
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench_web_"))
+    os.environ.setdefault("TG_API_ID", "1")
+    os.environ.setdefault("TG_API_HASH", "bench")
+    os.environ.setdefault("FLASK_SECRET_KEY", "bench")
+    os.environ["TG_SESSION_NAME"] = str(workdir / "bench")
+
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    import tg_listener.main as web
+    from tg_listener.db import SEARCH_CANDIDATES, Database
+
+    # Панель работает с заполненной БД; листенер не запускается
+    web.db = Database(f"sqlite+aiosqlite:///{db_path}")
+    web.archiver.db = web.db
+    if args.no_cache:
+        web.view_cache.max_entries = 0
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{args.port}"]
+    config.accesslog = None
+    shutdown = asyncio.Event()
+    server = asyncio.create_task(serve(web.app, config, shutdown_trigger=shutdown.wait))
+    await asyncio.sleep(0.5)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = {}
+    try:
+        for route in args.routes or ROUTES:
+            # Прогрев кэшей SQLite и шаблонов
+            await load(base_url, route, min(1.0, args.duration), 1)
+            results[route] = await load(base_url, route, args.duration, args.concurrency)
+            r = results[route]
+            print(f"{route}: {r['rps']:.1f} rps, p50 {r['p50_ms']:.1f} / p95 {r['p95_ms']:.1f} / "
+                  f"p99 {r['p99_ms']:.1f} мс, ошибок {r['errors']}")
+    finally:
+        shutdown.set()
+        await server
+
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    report(
+        "web",
+        {"db_rows": rows, "duration": args.duration, "concurrency": args.concurrency, "cache": not args.no_cache,
+         "search_candidates": SEARCH_CANDIDATES},
+        results,
+        args.json,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="путь к БД; если файла нет, он будет создан и заполнен")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="сообщений при заполнении")
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=5, help="секунд нагрузки на маршрут")
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременных клиентов")
+    parser.add_argument("--route", dest="routes", action="append", help="маршрут (можно несколько)")
+    parser.add_argument("--no-cache", action="store_true", help="отключить кэш страниц панели")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--json", help="дописать результат в JSONL-файл")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
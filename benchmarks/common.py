@@ -0,0 +1,80 @@
+"""Общие помощники бенчмарков: перцентили, пиковая память и вывод результатов."""
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# Бенчмарки запускаются как скрипты: подключаем корень проекта и папку бота
+for path in (ROOT_DIR, ROOT_DIR / "bot"):
+    if str(path) not in sys.path:
+        sys.path.append(str(path))
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Перцентиль q (0..100) уже отсортированной выборки, с линейной интерполяцией."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def latency_summary(latencies: list[float]) -> dict:
+    """p50/p95/p99/max в миллисекундах."""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] if values else 0.0) * 1000,
+    }
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def report(name: str, params: dict, results: dict, json_path: str = None):
+    """Печатает результаты и, если задан json_path, дописывает их строкой JSONL для сравнения коммитов."""
+    results = {**results, "peak_rss_mb": peak_rss_mb()}
+    print(f"\n=== {name} ({git_revision()}) ===")
+    print("параметры: " + ", ".join(f"{k}={v}" for k, v in params.items()))
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print(f"{key}: " + ", ".join(
+                f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in value.items()
+            ))
+        elif isinstance(value, float):
+            print(f"{key}: {value:.2f}")
+        else:
+            print(f"{key}: {value}")
+
+    if json_path:
+        record = {
+            "benchmark": name,
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "params": params,
+            "results": results,
+        }
+        with open(json_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
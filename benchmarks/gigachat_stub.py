@@ -0,0 +1,134 @@
+"""Локальная заглушка GigaChat: OAuth и chat/completions (обычный и потоковый режим).
+
+Запуск из корня проекта:
+    python benchmarks/gigachat_stub.py --port 8090 --latency 0.5 --error-rate 0.05
+
+и в .env бота:
+    GIGACHAT_OAUTH_URL=http://127.0.0.1:8090/api/v2/oauth
+    GIGACHAT_CHAT_URL=http://127.0.0.1:8090/api/v1/chat/completions
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+
+class StubState:
+    def __init__(self, latency: float = 0.2, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, token_ttl: float = 1800, chunk_delay: float = 0.05,
+                 reply: str = "Краткая сводка: ключевые события за период. Подробности в сообщениях канала."):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.token_ttl = token_ttl
+        self.chunk_delay = chunk_delay
+        self.reply = reply
+        self.tokens = {}
+        self.counters = {"oauth": 0, "chat": 0, "stream": 0, "errors": 0, "rate_limited": 0}
+
+    async def delay(self):
+        await asyncio.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+
+
+async def oauth(request: web.Request):
+    state: StubState = request.app["state"]
+    state.counters["oauth"] += 1
+    await state.delay()
+    token = uuid.uuid4().hex
+    expires_at = time.time() + state.token_ttl
+    state.tokens[token] = expires_at
+    return web.json_response({"access_token": token, "expires_at": int(expires_at * 1000)})
+
+
+async def chat(request: web.Request):
+    state: StubState = request.app["state"]
+    auth = request.headers.get("Authorization", "")
+    token = auth.removeprefix("Bearer ")
+    if state.tokens.get(token, 0) < time.time():
+        return web.json_response({"message": "Unauthorized"}, status=401)
+
+    payload = await request.json()
+    state.counters["chat"] += 1
+    await state.delay()
+
+    if random.random() < state.rate_limit_rate:
+        state.counters["rate_limited"] += 1
+        return web.json_response({"message": "Too Many Requests"}, status=429, headers={"Retry-After": "1"})
+    if random.random() < state.error_rate:
+        state.counters["errors"] += 1
+        return web.json_response({"message": "Internal Server Error"}, status=500)
+
+    prompt = payload["messages"][-1]["content"]
+    usage = {
+        "prompt_tokens": len(prompt) // 3,
+        "completion_tokens": len(state.reply) // 3,
+        "total_tokens": (len(prompt) + len(state.reply)) // 3,
+    }
+
+    if not payload.get("stream"):
+        return web.json_response({
+            "choices": [{"message": {"role": "assistant", "content": state.reply}, "index": 0}],
+            "usage": usage,
+            "model": payload.get("model"),
+        })
+
+    # Потоковый ответ: server-sent events по слову
+    state.counters["stream"] += 1
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for word in state.reply.split(" "):
+        chunk = {"choices": [{"delta": {"content": word + " "}, "index": 0}]}
+        await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await asyncio.sleep(state.chunk_delay)
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+async def stats(request: web.Request):
+    return web.json_response(request.app["state"].counters)
+
+
+def make_app(state: StubState = None) -> web.Application:
+    app = web.Application()
+    app["state"] = state or StubState()
+    app.router.add_post("/api/v2/oauth", oauth)
+    app.router.add_post("/api/v1/chat/completions", chat)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+async def start_stub(host: str = "127.0.0.1", port: int = 8090, state: StubState = None) -> web.AppRunner:
+    """Запускает заглушку в текущем цикле событий (для бенчмарков)."""
+    runner = web.AppRunner(make_app(state))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="разброс задержки, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--token-ttl", type=float, default=1800, help="время жизни токена, с")
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="пауза между фрагментами потока, с")
+    args = parser.parse_args()
+
+    state = StubState(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, token_ttl=args.token_ttl, chunk_delay=args.chunk_delay
+    )
+    web.run_app(make_app(state), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
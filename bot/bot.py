@@ -1,14 +1,19 @@
 import os
+import html
+import time
 import logging
 import asyncio
 import sys
 from pathlib import Path
+from typing import Optional
 import urllib3
+from aiohttp import web
 from dotenv import load_dotenv
 from telebot.async_telebot import AsyncTeleBot
-from sqlalchemy import select
-from tg_listener.db import Database, Message, Summary
-from summary_service import summarize_messages
+from tg_listener.db import Database, FTS_MARK_START, FTS_MARK_END
+from tg_listener import metrics
+from gigachat import GigaChatError, close_client
+from scheduler import DUPLICATES_ONLY, NO_NEW, SummaryScheduler
 
 # Отключаем предупреждения SSL для GigaChat
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -28,83 +33,253 @@ logging.basicConfig(
 )
 logger = logging.getLogger("tg_bot_summary")
 
+# Сколько результатов поиска показывать в чате
+SEARCH_RESULTS = 5
+# Не чаще одного редактирования сообщения за столько секунд (лимиты Telegram)
+EDIT_INTERVAL = float(os.getenv("BOT_EDIT_INTERVAL", "1.5"))
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Адрес, на котором бот отдаёт /metrics (порт 0 — не запускать)
+METRICS_HOST = os.getenv("BOT_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "9101"))
+
 bot = AsyncTeleBot(BOT_TOKEN)
 db = Database()
 
 
+def format_summary(channel, summary_text, start_dt, end_dt) -> str:
+    period = ""
+    if start_dt and end_dt:
+        period = f"📅 Период: {start_dt.strftime('%d.%m %H:%M')} – {end_dt.strftime('%d.%m %H:%M')}\n\n"
+    return f"📊 **Сводка: {channel.title}**\n{period}{summary_text}"
+
+
+async def deliver_summary(channel, summary_text, start_dt, end_dt):
+    """Рассылает готовую сводку всем подписанным чатам."""
+    response = format_summary(channel, summary_text, start_dt, end_dt)
+    for chat_id in await db.get_subscribers(channel.id):
+        try:
+            await bot.send_message(chat_id, response, parse_mode="Markdown")
+        except Exception as e:
+            logger.warning(f"Не удалось отправить сводку в чат {chat_id}: {e}")
+
+
+scheduler = SummaryScheduler(db, deliver_summary)
+
+
+class ProgressiveMessage:
+    """Сообщение-заглушка, которое дописывается по мере потоковой генерации сводки.
+
+    Промежуточные правки идут без разметки (незаконченный Markdown невалиден)
+    и не чаще EDIT_INTERVAL; финальный текст отправляется с разметкой.
+    """
+
+    def __init__(self, chat_id: int, message_id: int, header: str, min_interval: float = EDIT_INTERVAL):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.header = header
+        self.min_interval = min_interval
+        self._last_edit = 0.0
+        self._last_text = None
+
+    async def update(self, text: str):
+        if time.monotonic() - self._last_edit < self.min_interval:
+            return
+        await self._edit(f"{self.header}{text} ▌")
+
+    async def finish(self, text: str):
+        try:
+            await self._edit(text, parse_mode="Markdown")
+        except Exception:
+            await self._edit(text)
+
+    async def _edit(self, text: str, parse_mode: Optional[str] = None):
+        text = text[:TELEGRAM_MESSAGE_LIMIT]
+        if text == self._last_text:
+            return
+        self._last_edit = time.monotonic()
+        try:
+            await bot.edit_message_text(text, self.chat_id, self.message_id, parse_mode=parse_mode)
+            self._last_text = text
+        except Exception as e:
+            if parse_mode:
+                raise
+            logger.debug(f"Не удалось обновить сообщение: {e}")
+
+
+def command_argument(message) -> str:
+    parts = (message.text or "").split(maxsplit=1)
+    return parts[1].strip() if len(parts) > 1 else ""
+
+
+async def resolve_channel(message):
+    """Канал из аргумента команды; если его нет — сообщает пользователю и возвращает None."""
+    username = command_argument(message)
+    if not username:
+        await bot.send_message(message.chat.id, "ℹ️ Укажите канал, например: /subscribe @channel")
+        return None
+    channel = await db.get_channel_by_username(username)
+    if channel is None:
+        await bot.send_message(message.chat.id, f"⚠️ Канал {username} не найден.")
+    return channel
+
+
 @bot.message_handler(commands=["start"])
 async def start_command(message):
     await bot.send_message(
         message.chat.id,
         "🤖 **Бот-суммаризатор запущен.**\n\n"
-        "Команда: /summary – создать сводку по активному каналу.",
+        "Сводки готовятся автоматически по всем отслеживаемым каналам.\n"
+        "/summary – последние сводки по всем каналам\n"
+        "/summary @channel – последняя сводка канала\n"
+        "/summary_now @channel – пересчитать сводку канала прямо сейчас\n"
+        "/subscribe @channel – получать новые сводки канала\n"
+        "/unsubscribe @channel – отписаться\n"
+        "/search запрос – поиск по сообщениям",
         parse_mode="Markdown"
     )
 
 
 @bot.message_handler(commands=["summary"])
 async def summary_command(message):
-    await bot.send_chat_action(message.chat.id, "typing")
-
     try:
-        # Получаем **любой** отмеченный как мониторимый канал (например, первый)
-        # Или можно сделать выбор канала через аргумент команды, если нужно.
-        async with db.session_factory() as session:
-            from tg_listener.db import Channel
-            from sqlalchemy import select
-            result = await session.execute(
-                select(Channel).where(Channel.is_monitored == True).limit(1)
-            )
-            active_channel = result.scalar_one_or_none()
-
-        async with db.session_factory() as session:
-            result = await session.execute(
-                select(Message)
-                .where(Message.chat_id == active_channel.id)
-                .where(Message.is_summarized == False)
-                .order_by(Message.date.asc())
-                .limit(100)
-            )
-            rows = result.scalars().all()
-
-            if not rows:
-                await bot.send_message(message.chat.id, f"✅ Новых сообщений в канале **{active_channel.title}** нет.",
-                                       parse_mode="Markdown")
+        if command_argument(message):
+            channel = await resolve_channel(message)
+            if channel is None:
+                return
+            channels = [channel]
+        else:
+            channels = await db.get_monitored_channels()
+            if not channels:
+                await bot.send_message(message.chat.id, "ℹ️ Нет каналов с включённым мониторингом.")
                 return
 
-            texts = [m.text for m in rows]
-            start_dt = rows[0].date
-            end_dt = rows[-1].date
-
-            await bot.send_message(message.chat.id, f"🔄 Анализирую {len(rows)} сообщений...")
-            summary_text = await summarize_messages(texts)
-
-            await db.save_summary(
-                channel_id=active_channel.id,
-                content=summary_text,
-                start_dt=start_dt,
-                end_dt=end_dt
-            )
-
-            response = (
-                f"📊 **Сводка: {active_channel.title}**\n"
-                f"📅 Период: {start_dt.strftime('%H:%M')} – {end_dt.strftime('%H:%M')}\n\n"
-                f"{summary_text}"
-            )
+        # Отдаём заранее подготовленные сводки, не дожидаясь GigaChat
+        for channel in channels:
+            summary = await db.get_latest_summary(channel.id)
+            if summary is None:
+                scheduler.request(channel.id)
+                await bot.send_message(
+                    message.chat.id,
+                    f"⏳ Сводка по каналу **{channel.title}** ещё готовится.",
+                    parse_mode="Markdown"
+                )
+                continue
+            response = format_summary(channel, summary.content, summary.range_start, summary.range_end)
             await bot.send_message(message.chat.id, response, parse_mode="Markdown")
 
     except Exception as e:
-        logger.exception("Ошибка при создании сводки")
+        logger.exception("Ошибка при выдаче сводки")
         await bot.send_message(message.chat.id, "⚠️ Произошла ошибка при обработке данных.")
 
 
+@bot.message_handler(commands=["summary_now"])
+async def summary_now_command(message):
+    channel = await resolve_channel(message)
+    if channel is None:
+        return
+
+    placeholder = await bot.send_message(message.chat.id, f"⏳ Готовлю сводку по каналу {channel.title}…")
+    progress = ProgressiveMessage(message.chat.id, placeholder.message_id, f"📊 Сводка: {channel.title}\n\n")
+    try:
+        outcome = await scheduler.summarize_now(channel.id, on_progress=progress.update)
+        if outcome == NO_NEW:
+            await progress.finish(f"✅ Новых сообщений в канале **{channel.title}** нет.")
+            return
+        if outcome == DUPLICATES_ONLY:
+            await progress.finish(f"✅ В канале **{channel.title}** только повторы уже известных сообщений.")
+            return
+        summary = await db.get_latest_summary(channel.id)
+        await progress.finish(format_summary(channel, summary.content, summary.range_start, summary.range_end))
+    except GigaChatError as e:
+        logger.warning(f"GigaChat не ответил для канала {channel.id}: {e}")
+        await progress.finish("⚠️ GigaChat временно недоступен, попробуйте позже. Готовые части сводки сохранены.")
+    except Exception:
+        logger.exception("Ошибка при создании сводки")
+        await progress.finish("⚠️ Произошла ошибка при обработке данных.")
+
+
+@bot.message_handler(commands=["subscribe"])
+async def subscribe_command(message):
+    channel = await resolve_channel(message)
+    if channel is None:
+        return
+    await db.add_subscription(message.chat.id, channel.id)
+    await bot.send_message(message.chat.id, f"🔔 Новые сводки канала **{channel.title}** будут приходить сюда.",
+                           parse_mode="Markdown")
+
+
+@bot.message_handler(commands=["unsubscribe"])
+async def unsubscribe_command(message):
+    channel = await resolve_channel(message)
+    if channel is None:
+        return
+    await db.remove_subscription(message.chat.id, channel.id)
+    await bot.send_message(message.chat.id, f"🔕 Подписка на канал **{channel.title}** отменена.",
+                           parse_mode="Markdown")
+
+
+@bot.message_handler(commands=["search"])
+async def search_command(message):
+    query = command_argument(message)
+    if not query:
+        await bot.send_message(message.chat.id, "ℹ️ Укажите запрос, например: /search курс рубля")
+        return
+
+    try:
+        results = await db.search(query, limit=SEARCH_RESULTS)
+    except Exception:
+        logger.exception("Ошибка поиска")
+        await bot.send_message(message.chat.id, "⚠️ Произошла ошибка при поиске.")
+        return
+
+    if not results:
+        await bot.send_message(message.chat.id, "🔍 Ничего не найдено.")
+        return
+
+    lines = [f"🔍 <b>Результаты по запросу «{html.escape(query)}»</b>"]
+    for item in results[:SEARCH_RESULTS]:
+        snippet = (
+            html.escape(item["snippet"] or "")
+            .replace(FTS_MARK_START, "<b>")
+            .replace(FTS_MARK_END, "</b>")
+        )
+        date = item["date"].strftime("%d.%m %H:%M") if item["date"] else ""
+        lines.append(f"\n<i>{html.escape(item['channel'])}, {date}</i>\n{snippet}")
+    await bot.send_message(message.chat.id, "\n".join(lines), parse_mode="HTML")
+
+
+async def start_metrics_server() -> Optional[web.AppRunner]:
+    """HTTP-сервер с одним маршрутом /metrics (формат Prometheus)."""
+    if not METRICS_PORT:
+        return None
+
+    async def handle_metrics(request):
+        return web.Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+
 async def run_bot():
+    metrics_runner = None
     try:
         await db.init_db()
+        metrics_runner = await start_metrics_server()
+        scheduler.start()
         logger.info("🚀 Telegram бот запущен (polling)...")
         await bot.polling(non_stop=True, interval=0, timeout=20)
     except Exception as e:
         logger.error(f"Ошибка при работе бота: {e}")
+    finally:
+        await scheduler.stop()
+        await close_client()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,116 @@
+import re
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional, Union
+
+# Грубая оценка для токенизатора GigaChat: ~3 символа кириллицы на токен
+CHARS_PER_TOKEN = 3.0
+
+# Бюджет токенов на один запрос: контекст модели минус запас на ответ
+MODEL_CONTEXT_TOKENS = {
+    "GigaChat": 8192,
+    "GigaChat-Pro": 32768,
+    "GigaChat-Max": 32768,
+}
+RESPONSE_RESERVE_TOKENS = 1024
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка количества токенов без вызова токенизатора."""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def token_budget(model: str, prompt_template: str) -> int:
+    """Сколько токенов текста помещается в запрос с учётом шаблона промпта и ответа."""
+    context = MODEL_CONTEXT_TOKENS.get(model, MODEL_CONTEXT_TOKENS["GigaChat"])
+    overhead = estimate_tokens(prompt_template)
+    return max(context - RESPONSE_RESERVE_TOKENS - overhead, 1)
+
+
+def split_oversized(text: str, budget: int) -> Iterator[str]:
+    """Режет слишком длинное сообщение по границам предложений.
+
+    Если и одно предложение не влезает в бюджет, оно режется по длине.
+    """
+    max_chars = max(int((budget - 1) * CHARS_PER_TOKEN), 1)
+    piece = ""
+    for sentence in _SENTENCE_END.split(text):
+        while len(sentence) > max_chars:
+            if piece:
+                yield piece
+                piece = ""
+            yield sentence[:max_chars]
+            sentence = sentence[max_chars:]
+        if piece and len(piece) + 1 + len(sentence) > max_chars:
+            yield piece
+            piece = sentence
+        else:
+            piece = f"{piece} {sentence}" if piece else sentence
+    if piece:
+        yield piece
+
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    """Начало текста, которое влезает в budget токенов (по границе предложения, если она есть)."""
+    if estimate_tokens(text) <= budget:
+        return text
+    return next(split_oversized(text, budget), "")
+
+
+class ChunkPacker:
+    """Упаковывает сообщения в чанки не больше budget токенов.
+
+    add() возвращает чанки, которые уже заполнены, flush() — последний.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self._current = []
+        self._current_tokens = 0
+
+    def add(self, msg: str) -> list[str]:
+        ready = []
+        if not msg or not msg.strip():
+            return ready
+        pieces = [msg] if estimate_tokens(msg) <= self.budget else split_oversized(msg, self.budget)
+        for piece in pieces:
+            tokens = estimate_tokens(piece)
+            if self._current and self._current_tokens + tokens > self.budget:
+                ready.append(self.flush())
+            self._current.append(piece)
+            self._current_tokens += tokens
+        return ready
+
+    def flush(self) -> Optional[str]:
+        if not self._current:
+            return None
+        chunk = "\n".join(self._current)
+        self._current = []
+        self._current_tokens = 0
+        return chunk
+
+
+def iter_chunks(messages: Iterable[str], budget: int) -> Iterator[str]:
+    """Лениво отдаёт чанки: каждый — как только следующий фрагмент в него не влезает."""
+    packer = ChunkPacker(budget)
+    for msg in messages:
+        yield from packer.add(msg)
+    last = packer.flush()
+    if last:
+        yield last
+
+
+async def aiter_chunks(messages: Union[Iterable[str], AsyncIterable[str]], budget: int) -> AsyncIterator[str]:
+    """То же, что iter_chunks, но принимает и асинхронный поток сообщений."""
+    if not hasattr(messages, "__aiter__"):
+        for chunk in iter_chunks(messages, budget):
+            yield chunk
+        return
+
+    packer = ChunkPacker(budget)
+    async for msg in messages:
+        for chunk in packer.add(msg):
+            yield chunk
+    last = packer.flush()
+    if last:
+        yield last
@@ -0,0 +1,107 @@
+"""Сводки текстовых файлов и выгрузок чатов из командной строки.
+
+Запуск из корня проекта:
+    python bot/cli.py chat_export.txt
+    python bot/cli.py exports/ --glob "*.txt" --jobs 4
+
+Сводка каждого файла пишется рядом с ним в <файл>.summary.txt. Кодировка
+определяется по началу файла, сам файл читается через mmap и декодируется
+блоками прямо в нарезку на чанки, поэтому размер файла не ограничен памятью.
+Несколько файлов обрабатываются одновременно (--jobs); запросы к GigaChat
+внутри одного файла ограничены SUMMARY_MAX_CONCURRENCY и SUMMARY_MAX_RPS.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+root_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(root_dir))
+
+from gigachat import close_client  # noqa: E402
+from summary_service import summarize_messages  # noqa: E402
+from utils import aiter_lines, detect_encoding, setup_logger  # noqa: E402
+
+SUMMARY_SUFFIX = ".summary.txt"
+
+logger = setup_logger()
+
+
+def output_path(path: Path) -> Path:
+    return path.with_name(path.name + SUMMARY_SUFFIX)
+
+
+def collect_files(paths: list[str], pattern: str) -> list[Path]:
+    """Файлы из аргументов; каталоги обходятся рекурсивно по шаблону, готовые сводки пропускаются."""
+    files = []
+    for raw in paths:
+        path = Path(raw).resolve()
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob(pattern) if p.is_file()))
+        elif path.is_file():
+            files.append(path)
+        else:
+            logger.warning(f"Пропущено: {path} не найден")
+    # Порядок сохраняем, повторы убираем
+    return [p for p in dict.fromkeys(files) if not p.name.endswith(SUMMARY_SUFFIX)]
+
+
+async def summarize_file(path: Path, force: bool = False) -> bool:
+    target = output_path(path)
+    if not force and target.exists() and target.stat().st_mtime >= path.stat().st_mtime:
+        logger.info(f"Пропущено (сводка свежая): {path}")
+        return True
+
+    started = time.perf_counter()
+    try:
+        encoding, confidence = detect_encoding(path)
+        logger.info(f"Файл {path}: {path.stat().st_size / 1024 / 1024:.1f} МБ, "
+                    f"encoding={encoding}, confidence={confidence:.2f}")
+        summary = await summarize_messages(aiter_lines(path, encoding))
+    except Exception as e:
+        logger.error(f"Не удалось обработать {path}: {e}")
+        return False
+
+    # Пишем во временный файл и подменяем: оборванная запись не оставит полусводку
+    tmp = target.with_name(target.name + ".tmp")
+    tmp.write_text(summary + "\n", encoding="utf-8")
+    os.replace(tmp, target)
+    logger.info(f"Сводка {path} -> {target.name} за {time.perf_counter() - started:.1f} с")
+    return True
+
+
+async def run(args) -> int:
+    files = collect_files(args.paths, args.glob)
+    if not files:
+        logger.warning("Нет файлов для обработки")
+        return 1
+
+    semaphore = asyncio.Semaphore(args.jobs)
+
+    async def one(path):
+        async with semaphore:
+            return await summarize_file(path, force=args.force)
+
+    try:
+        results = await asyncio.gather(*(one(path) for path in files))
+    finally:
+        await close_client()
+
+    failed = results.count(False)
+    logger.info(f"Готово: файлов {len(files)}, с ошибкой {failed}")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="файлы или каталоги")
+    parser.add_argument("--glob", default="*.txt", help="шаблон имён файлов в каталогах (по умолчанию *.txt)")
+    parser.add_argument("--jobs", type=int, default=2, help="файлов одновременно")
+    parser.add_argument("--force", action="store_true", help="пересоздать уже готовые сводки")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
 import os
+import json
+import time
 import uuid
+import random
+import asyncio
 import aiohttp
 import logging
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from typing import AsyncIterator, Optional
 from dotenv import load_dotenv
+from tg_listener.metrics import Counter, Gauge, Histogram
 
 # Определяем корень проекта относительно этого файла (поднимаемся на уровень выше)
 root_dir = Path(__file__).resolve().parent.parent
@@ -15,74 +22,439 @@ logger = logging.getLogger("gigachat")
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 
-OAUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-CHAT_URL = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+# Адреса можно переопределить, например, для локальной заглушки в benchmarks/gigachat_stub.py
+OAUTH_URL = os.getenv("GIGACHAT_OAUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+CHAT_URL = os.getenv("GIGACHAT_CHAT_URL", "https://gigachat.devices.sberbank.ru/api/v1/chat/completions")
 
 
 class GigaChatError(Exception):
     pass
 
 
-async def get_access_token_async() -> str:
-    """Асинхронное получение токена доступа."""
-    if not CLIENT_ID or not CLIENT_SECRET:
-        raise GigaChatError("CLIENT_ID или CLIENT_SECRET не заданы")
-
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Accept": "application/json",
-        "RqUID": str(uuid.uuid4()),
-        "Authorization": f"Basic {CLIENT_SECRET}",
-    }
-    payload = {"scope": "GIGACHAT_API_PERS"}
-
-    # verify_ssl=False заменяет verify=False из requests
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(
-                    OAUTH_URL,
-                    headers=headers,
-                    data=payload,
-                    ssl=False
-            ) as response:
-                response.raise_for_status()
-                data = await response.json()
-                return data["access_token"]
-        except Exception as e:
-            logger.error(f"Ошибка получения токена: {e}")
-            raise GigaChatError(f"Не удалось получить токен: {e}")
+class GigaChatTransientError(GigaChatError):
+    """Временный сбой (сеть, таймаут, 5xx, 429): запрос имеет смысл повторить."""
 
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        # Сколько сервер просит подождать (Retry-After), если сказал
+        self.retry_after = retry_after
 
-async def generate_summary_async(text: str) -> str:
-    """Асинхронная генерация саммари."""
+
+class GigaChatPermanentError(GigaChatError):
+    """Ошибка, которую повтор не исправит (неверный запрос, нет доступа)."""
+
+
+class CircuitOpenError(GigaChatError):
+    """GigaChat недавно отказывал подряд: запросы не отправляются до пробного."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"GigaChat недоступен, повторная попытка через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+# Обновляем токен заранее, не дожидаясь истечения срока
+TOKEN_REFRESH_MARGIN = 60
+MAX_CONNECTIONS = int(os.getenv("GIGACHAT_MAX_CONNECTIONS", "10"))
+KEEPALIVE_TIMEOUT = float(os.getenv("GIGACHAT_KEEPALIVE_TIMEOUT", "60"))
+MODEL = os.getenv("GIGACHAT_MODEL", "GigaChat")
+
+# Повторы: до GIGACHAT_MAX_ATTEMPTS попыток с экспоненциальной паузой со случайным разбросом,
+# но не дольше GIGACHAT_DEADLINE секунд на весь вызов; одна попытка — не дольше GIGACHAT_REQUEST_TIMEOUT
+MAX_ATTEMPTS = int(os.getenv("GIGACHAT_MAX_ATTEMPTS", "4"))
+BACKOFF_BASE = float(os.getenv("GIGACHAT_BACKOFF_BASE", "1"))
+BACKOFF_MAX = float(os.getenv("GIGACHAT_BACKOFF_MAX", "30"))
+REQUEST_TIMEOUT = float(os.getenv("GIGACHAT_REQUEST_TIMEOUT", "60"))
+DEADLINE = float(os.getenv("GIGACHAT_DEADLINE", "180"))
+# Предохранитель: после стольких сбоев подряд запросы не отправляются BREAKER_RESET_TIMEOUT секунд
+BREAKER_FAILURES = int(os.getenv("GIGACHAT_BREAKER_FAILURES", "10"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("GIGACHAT_BREAKER_RESET_TIMEOUT", "30"))
+
+REQUEST_SECONDS = Histogram(
+    "bot_gigachat_request_seconds", "Время запроса к GigaChat (поток — до последнего фрагмента)", ["mode"]
+)
+REQUEST_ERRORS = Counter("bot_gigachat_errors_total", "Ошибки запросов к GigaChat", ["mode", "reason"])
+TOKENS = Counter("bot_gigachat_tokens_total", "Токены по данным GigaChat (usage)", ["kind"])
+OAUTH_REQUESTS = Counter("bot_gigachat_oauth_requests_total", "Запросов нового токена доступа")
+RETRIES = Counter("bot_gigachat_retries_total", "Повторов запроса после временного сбоя", ["reason"])
+BREAKER_STATE = Gauge(
+    "bot_gigachat_circuit_state", "Предохранитель GigaChat: 0 — закрыт, 1 — пробный запрос, 2 — открыт"
+)
+BREAKER_REJECTED = Counter("bot_gigachat_circuit_rejected_total", "Запросов отклонено открытым предохранителем")
+
+
+def _error_reason(error: Exception) -> str:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return f"http_{error.status}"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, aiohttp.ClientError):
+        return "network"
+    return type(error).__name__
+
+
+def _retry_after(error: aiohttp.ClientResponseError) -> Optional[float]:
+    """Retry-After в секундах: число или HTTP-дата."""
+    value = (error.headers or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
     try:
-        token = await get_access_token_async()
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error: Exception) -> GigaChatError:
+    """Приводит исключение запроса к временной или постоянной ошибке GigaChat."""
+    if isinstance(error, GigaChatError):
+        return error
+    if isinstance(error, aiohttp.ClientResponseError):
+        message = f"HTTP {error.status}: {error.message}"
+        if error.status == 429 or error.status == 408 or error.status >= 500:
+            return GigaChatTransientError(message, retry_after=_retry_after(error))
+        return GigaChatPermanentError(message)
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError)):
+        return GigaChatTransientError(f"{type(error).__name__}: {error}")
+    # Оборванный или неожиданный ответ (нет нужных полей, не JSON) — тоже временный сбой
+    if isinstance(error, (ValueError, KeyError, IndexError, TypeError)):
+        return GigaChatTransientError(f"Некорректный ответ GigaChat: {type(error).__name__}: {error}")
+    return GigaChatPermanentError(f"{type(error).__name__}: {error}")
+
+
+class CircuitBreaker:
+    """Предохранитель: после failure_threshold временных сбоев подряд запросы
+    сразу отклоняются reset_timeout секунд, затем пропускается один пробный.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        BREAKER_STATE.set(self.CLOSED)
+
+    def _set_state(self, state: int):
+        if state != self.state:
+            logger.warning(f"Предохранитель GigaChat: {('закрыт', 'пробный запрос', 'открыт')[state]}")
+        self.state = state
+        BREAKER_STATE.set(state)
+
+    def before_request(self):
+        """Пропускает запрос или бросает CircuitOpenError."""
+        if self.state == self.CLOSED:
+            return
+        remaining = self._opened_at + self.reset_timeout - time.monotonic()
+        if self.state == self.OPEN and remaining <= 0:
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        BREAKER_REJECTED.inc()
+        raise CircuitOpenError(max(remaining, 1.0))
+
+    def release(self):
+        """Запрос отменён, не дав ответа: пробный можно отправить снова."""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self._probe_in_flight = False
+        self._set_state(self.CLOSED)
+
+    def record_failure(self, error: GigaChatError):
+        self._probe_in_flight = False
+        # 429 и постоянные ошибки означают, что сервис отвечает: предохранитель не трогаем
+        if not isinstance(error, GigaChatTransientError) or error.retry_after is not None:
+            if self.state == self.HALF_OPEN:
+                self._set_state(self.CLOSED)
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None,
+                  base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """Пауза перед повтором номер attempt (с 1): «полный разброс» от 0 до base * 2^(attempt-1),
+    но не меньше, чем просил сервер в Retry-After.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, base))
+    return delay
+
+
+def _record_usage(usage: Optional[dict]):
+    for kind in ("prompt", "completion"):
+        count = (usage or {}).get(f"{kind}_tokens")
+        if count:
+            TOKENS.labels(kind).inc(count)
+
+
+class GigaChatClient:
+    """Долгоживущий клиент GigaChat.
+
+    Держит один пул соединений (keep-alive) на всё время работы и кэширует
+    токен доступа до момента незадолго до его истечения. Если несколько
+    запросов одновременно обнаружили, что токен устарел, за новым токеном
+    сходит только один из них.
+    """
+
+    def __init__(self, client_id: Optional[str] = CLIENT_ID, client_secret: Optional[str] = CLIENT_SECRET,
+                 model: str = MODEL, max_connections: int = MAX_CONNECTIONS,
+                 keepalive_timeout: float = KEEPALIVE_TIMEOUT):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.model = model
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock: Optional[asyncio.Lock] = None
+
+        self.breaker = CircuitBreaker()
+
+        # Счётчики для диагностики
+        self.token_requests = 0
+        self.chat_requests = 0
+        self.retries = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout,
+                ssl=False,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def _token_is_fresh(self) -> bool:
+        return self._token is not None and time.time() < self._token_expires_at - TOKEN_REFRESH_MARGIN
+
+    async def get_access_token(self) -> str:
+        """Возвращает кэшированный токен или получает новый (один запрос на всех)."""
+        if self._token_is_fresh():
+            return self._token
+
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            # Пока ждали блокировку, токен мог обновить другой запрос
+            if self._token_is_fresh():
+                return self._token
+            self._token, self._token_expires_at = await self._request_token()
+            return self._token
+
+    def invalidate_token(self):
+        self._token = None
+        self._token_expires_at = 0.0
+
+    async def _request_token(self):
+        if not self.client_id or not self.client_secret:
+            raise GigaChatError("CLIENT_ID или CLIENT_SECRET не заданы")
 
         headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json",
+            "RqUID": str(uuid.uuid4()),
+            "Authorization": f"Basic {self.client_secret}",
         }
+        payload = {"scope": "GIGACHAT_API_PERS"}
 
+        self.token_requests += 1
+        OAUTH_REQUESTS.inc()
+        try:
+            async with self._get_session().post(OAUTH_URL, headers=headers, data=payload) as response:
+                response.raise_for_status()
+                data = await response.json()
+        except Exception as e:
+            logger.error(f"Ошибка получения токена: {e}")
+            error = classify_error(e)
+            error.args = (f"Не удалось получить токен: {error}",)
+            raise error from e
+
+        # expires_at приходит в миллисекундах; если его нет — токен живёт 30 минут
+        expires_at = data.get("expires_at")
+        expires_at = expires_at / 1000 if expires_at else time.time() + 30 * 60
+        return data["access_token"], expires_at
+
+    def _chat_payload(self, text: str, system: str, temperature: float, stream: bool = False) -> dict:
         payload = {
-            "model": "GigaChat",
+            "model": self.model,
             "messages": [
-                {"role": "system", "content": "Сделай краткую структурированную сводку."},
+                {"role": "system", "content": system},
                 {"role": "user", "content": text},
             ],
-            "temperature": 0.7
+            "temperature": temperature
         }
+        if stream:
+            payload["stream"] = True
+        return payload
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                    CHAT_URL,
-                    json=payload,
-                    headers=headers,
-                    ssl=False,
-                    timeout=aiohttp.ClientTimeout(total=60)
-            ) as response:
+    async def _post_chat(self, payload: dict, timeout: aiohttp.ClientTimeout) -> aiohttp.ClientResponse:
+        """Отправляет запрос к chat/completions. Ответ нужно закрыть вызывающему."""
+        for attempt in range(2):
+            token = await self.get_access_token()
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            }
+            self.chat_requests += 1
+            response = await self._get_session().post(CHAT_URL, json=payload, headers=headers, timeout=timeout)
+            # Токен отозван раньше срока — получаем новый и повторяем один раз
+            if response.status == 401 and attempt == 0:
+                response.release()
+                self.invalidate_token()
+                continue
+            if response.status >= 400:
+                response.release()
                 response.raise_for_status()
-                result = await response.json()
+            return response
+
+    async def _complete_once(self, payload: dict, timeout: float) -> str:
+        """Одна попытка запроса; любая ошибка приводится к GigaChatError."""
+        started = time.perf_counter()
+        try:
+            # wait_for ограничивает и получение токена, ClientTimeout — сам запрос
+            async def attempt():
+                async with await self._post_chat(payload, aiohttp.ClientTimeout(total=timeout)) as response:
+                    result = await response.json()
+                _record_usage(result.get("usage"))
                 return result["choices"][0]["message"]["content"]
-    except Exception as e:
+
+            return await asyncio.wait_for(attempt(), timeout)
+        except Exception as e:
+            REQUEST_ERRORS.labels("complete", _error_reason(e.__cause__ or e)).inc()
+            raise classify_error(e) from e
+        finally:
+            REQUEST_SECONDS.labels("complete").observe(time.perf_counter() - started)
+
+    async def complete(self, text: str, system: str = "Сделай краткую структурированную сводку.",
+                       temperature: float = 0.7, deadline: float = DEADLINE,
+                       max_attempts: int = MAX_ATTEMPTS) -> str:
+        """Генерация с повторами временных сбоев.
+
+        Между попытками — экспоненциальная пауза со случайным разбросом (не меньше
+        Retry-After при 429). Весь вызов укладывается в deadline секунд; при открытом
+        предохранителе ошибка CircuitOpenError возвращается сразу, без запроса.
+        """
+        payload = self._chat_payload(text, system, temperature)
+        give_up_at = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.before_request()
+            try:
+                result = await self._complete_once(payload, min(REQUEST_TIMEOUT, give_up_at - time.monotonic()))
+            except GigaChatError as e:
+                self.breaker.record_failure(e)
+                if not isinstance(e, GigaChatTransientError) or attempt >= max_attempts:
+                    raise
+                delay = backoff_delay(attempt, e.retry_after)
+                # На паузу и хотя бы секунду следующей попытки должно хватить времени
+                if time.monotonic() + delay + 1 >= give_up_at:
+                    raise
+                self.retries += 1
+                RETRIES.labels(_error_reason(e.__cause__ or e)).inc()
+                logger.warning(f"GigaChat: {e}; попытка {attempt + 1} из {max_attempts} через {delay:.1f} с")
+                await asyncio.sleep(delay)
+                continue
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def stream(self, text: str, system: str = "Сделай краткую структурированную сводку.",
+                     temperature: float = 0.7) -> AsyncIterator[str]:
+        """Потоковая генерация: отдаёт фрагменты ответа по мере их прихода (server-sent events)."""
+        payload = self._chat_payload(text, system, temperature, stream=True)
+        # Общего таймаута нет: ограничиваем только паузу между фрагментами
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=REQUEST_TIMEOUT)
+        # Поток не повторяем (часть ответа уже отдана), но через предохранитель пропускаем
+        self.breaker.before_request()
+        started = time.perf_counter()
+        try:
+            async with await self._post_chat(payload, timeout) as response:
+                async for raw_line in response.content:
+                    line = raw_line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    # usage приходит в последнем фрагменте
+                    _record_usage(chunk.get("usage"))
+                    choices = chunk.get("choices") or []
+                    if choices:
+                        delta = (choices[0].get("delta") or {}).get("content")
+                        if delta:
+                            yield delta
+        except Exception as e:
+            REQUEST_ERRORS.labels("stream", _error_reason(e)).inc()
+            error = classify_error(e)
+            self.breaker.record_failure(error)
+            raise error from e
+        except BaseException:
+            self.breaker.release()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            REQUEST_SECONDS.labels("stream").observe(time.perf_counter() - started)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+_client: Optional[GigaChatClient] = None
+
+
+def get_client() -> GigaChatClient:
+    """Общий для процесса клиент GigaChat."""
+    global _client
+    if _client is None:
+        _client = GigaChatClient()
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+async def get_access_token_async() -> str:
+    """Асинхронное получение токена доступа."""
+    return await get_client().get_access_token()
+
+
+async def stream_summary_async(text: str) -> AsyncIterator[str]:
+    """Потоковая генерация саммари; ошибки пробрасываются вызывающему."""
+    async for delta in get_client().stream(text):
+        yield delta
+
+
+async def generate_summary_async(text: str) -> str:
+    """Асинхронная генерация саммари; после исчерпания повторов бросает GigaChatError."""
+    try:
+        return await get_client().complete(text)
+    except GigaChatError as e:
         logger.error(f"Ошибка GigaChat: {e}")
-        return f"Ошибка при генерации сводки: {str(e)}"
+        raise
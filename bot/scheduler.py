@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+from gigachat import GigaChatError
+from summary_service import summarize_messages
+
+logger = logging.getLogger("summary_scheduler")
+
+# Как часто проверять каналы и как часто суммаризировать даже небольшой хвост сообщений
+CHECK_INTERVAL = float(os.getenv("SCHEDULER_CHECK_INTERVAL", "60"))
+SUMMARY_INTERVAL = float(os.getenv("SCHEDULER_SUMMARY_INTERVAL", "3600"))
+# Столько новых сообщений запускают сводку сразу, не дожидаясь интервала
+BACKLOG_THRESHOLD = int(os.getenv("SCHEDULER_BACKLOG_THRESHOLD", "50"))
+# Глобальный лимит одновременных сводок и размер одной порции сообщений
+MAX_CONCURRENT_JOBS = int(os.getenv("SCHEDULER_MAX_JOBS", "2"))
+BATCH_LIMIT = int(os.getenv("SCHEDULER_BATCH_LIMIT", "500"))
+
+# Итог одного захода по каналу
+NO_NEW = "no_new"                    # новых сообщений нет
+DUPLICATES_ONLY = "duplicates_only"  # в порции одни повторы: водяной знак сдвинут, сводки нет
+SUMMARIZED = "summarized"            # сохранена новая сводка
+
+
+class SummaryScheduler:
+    """Фоновая суммаризация всех отслеживаемых каналов.
+
+    Каналы ставятся в общую очередь по кругу: за один заход канал
+    суммаризирует не больше BATCH_LIMIT сообщений и, если хвост остался,
+    встаёт в конец очереди. Так загруженный канал не задерживает тихие.
+    Одновременно выполняется не больше MAX_CONCURRENT_JOBS сводок, а один
+    канал никогда не обрабатывается параллельно сам с собой.
+    """
+
+    def __init__(self, db, deliver: Callable[..., Awaitable[None]],
+                 check_interval: float = CHECK_INTERVAL, summary_interval: float = SUMMARY_INTERVAL,
+                 backlog_threshold: int = BACKLOG_THRESHOLD, max_concurrent_jobs: int = MAX_CONCURRENT_JOBS,
+                 batch_limit: int = BATCH_LIMIT):
+        self.db = db
+        self.deliver = deliver
+        self.check_interval = check_interval
+        self.summary_interval = summary_interval
+        self.backlog_threshold = backlog_threshold
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.batch_limit = batch_limit
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued = set()    # каналы, ожидающие в очереди
+        self._running = set()   # каналы, которые суммаризируются прямо сейчас
+        self._last_run = {}     # channel_id -> time.monotonic() последней сводки
+        self._locks = {}        # channel_id -> asyncio.Lock: канал не суммаризируется параллельно
+        # Общий лимит сводок для воркеров и запросов пользователей (summarize_now)
+        self._slots = asyncio.Semaphore(max_concurrent_jobs)
+        self._tasks = []
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._scan_loop())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.max_concurrent_jobs)]
+        logger.info(f"Планировщик сводок запущен: {self.max_concurrent_jobs} воркер(ов)")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def request(self, channel_id: int):
+        """Ставит канал в очередь вне расписания (если он ещё не в работе)."""
+        if self._queue is None or channel_id in self._queued or channel_id in self._running:
+            return
+        self._queued.add(channel_id)
+        self._queue.put_nowait(channel_id)
+
+    async def summarize_now(self, channel_id: int,
+                            on_progress: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        """Суммаризирует канал вне очереди (по запросу пользователя), соблюдая общий лимит сводок.
+
+        on_progress получает текст сводки по мере генерации. Возвращает итог:
+        NO_NEW, DUPLICATES_ONLY или SUMMARIZED. Оставшийся хвост доделают воркеры.
+        """
+        if not await self.db.count_unsummarized(channel_id):
+            return NO_NEW
+        outcome, has_more = await self._run_job(channel_id, on_progress)
+        if has_more:
+            self.request(channel_id)
+        return outcome
+
+    async def _scan_loop(self):
+        while True:
+            try:
+                await self._scan()
+            except Exception:
+                logger.exception("Ошибка при проверке каналов")
+            await asyncio.sleep(self.check_interval)
+
+    async def _scan(self):
+        now = time.monotonic()
+        for channel in await self.db.get_monitored_channels():
+            backlog = await self.db.count_unsummarized(channel.id)
+            if not backlog:
+                continue
+            last_run = self._last_run.setdefault(channel.id, now)
+            if backlog >= self.backlog_threshold or now - last_run >= self.summary_interval:
+                self.request(channel.id)
+
+    async def _worker(self):
+        while True:
+            channel_id = await self._queue.get()
+            self._queued.discard(channel_id)
+            self._running.add(channel_id)
+            has_more = False
+            try:
+                _, has_more = await self._run_job(channel_id)
+            except GigaChatError as e:
+                # Сводка не сохранена и сообщения остались несуммаризированными:
+                # канал будет взят снова при одной из следующих проверок
+                logger.warning(f"GigaChat не ответил для канала {channel_id}, повтор позже: {e}")
+            except Exception:
+                logger.exception(f"Ошибка при суммаризации канала {channel_id}")
+            finally:
+                self._running.discard(channel_id)
+                self._last_run[channel_id] = time.monotonic()
+            if has_more:
+                self.request(channel_id)
+
+    async def _run_job(self, channel_id: int,
+                       on_progress: Optional[Callable[[str], Awaitable[None]]] = None) -> tuple[str, bool]:
+        """Суммаризирует одну порцию сообщений канала. Возвращает (итог, остался ли хвост)."""
+        lock = self._locks.setdefault(channel_id, asyncio.Lock())
+        async with self._slots, lock:
+            return await self._summarize_batch(channel_id, on_progress)
+
+    async def _summarize_batch(self, channel_id: int, on_progress) -> tuple[str, bool]:
+        channel = await self.db.get_channel_by_id(channel_id)
+        if channel is None or (not channel.is_monitored and on_progress is None):
+            return NO_NEW, False
+
+        rows = await self.db.get_unsummarized_messages(channel_id, limit=self.batch_limit)
+        if not rows:
+            return NO_NEW, False
+        has_more = len(rows) >= self.batch_limit
+        # Порция выбирается по id (водяной знак), а в LLM и в период сводки
+        # идёт по времени публикации: догруженные сообщения могут получить id позже живых
+        last_message_id = max(m.id for m in rows)
+        rows = sorted(rows, key=lambda m: (m.date, m.id))
+
+        # Повторы и перепосты в LLM не отправляем
+        texts = [m.text for m in rows if not m.is_duplicate]
+        skipped = len(rows) - len(texts)
+        if skipped:
+            logger.info(f"Канал {channel.title}: пропущено повторов {skipped}")
+        if not texts:
+            await self.db.advance_watermark(channel_id, last_message_id)
+            return DUPLICATES_ONLY, has_more
+
+        started = time.monotonic()
+        summary_text = await summarize_messages(
+            texts, previous_summary=channel.summary_context, on_progress=on_progress
+        )
+        await self.db.save_summary(
+            channel_id=channel_id,
+            content=summary_text,
+            start_dt=rows[0].date,
+            end_dt=rows[-1].date,
+            last_message_id=last_message_id
+        )
+        logger.info(
+            f"Сводка канала {channel.title}: {len(rows)} сообщений за {time.monotonic() - started:.1f} с"
+        )
+
+        await self.deliver(channel, summary_text, rows[0].date, rows[-1].date)
+        return SUMMARIZED, has_more
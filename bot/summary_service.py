@@ -1,56 +1,251 @@
-from gigachat import generate_summary_async
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterable, Awaitable, Callable, Iterable, Optional, Union
+from gigachat import MODEL, GigaChatTransientError, generate_summary_async, stream_summary_async
+from chunker import aiter_chunks, estimate_tokens, token_budget, truncate_to_budget
+from summary_cache import get_cache
+from tg_listener.metrics import SIZE_BUCKETS, Counter, Histogram
 
-# Лимит символов для GigaChat (безопасное значение для Lite-модели)
-MAX_CHARS = 10000
+logger = logging.getLogger("summary_service")
 
+# Сколько запросов к GigaChat выполняется одновременно и не чаще скольких в секунду
+MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", "4"))
+MAX_RPS = float(os.getenv("SUMMARY_MAX_RPS", "2"))
+# Сколько прочитанных чанков может ждать сводки: MAX_CONCURRENCY в работе и столько же в очереди
+READ_AHEAD_CHUNKS = 2 * MAX_CONCURRENCY
+# Предыдущая сводка занимает не больше этой доли окна финального слияния — остальное для новых данных
+PREVIOUS_SUMMARY_SHARE = float(os.getenv("SUMMARY_PREVIOUS_SHARE", "0.25"))
 
-async def summarize_messages(messages: list[str]) -> str:
-    if not messages:
-        return "Нет сообщений для суммаризации."
+SUMMARY_CHUNKS = Histogram("bot_summary_chunks", "Чанков в одной сводке", buckets=SIZE_BUCKETS)
+SUMMARY_SECONDS = Histogram("bot_summary_seconds", "Время построения сводки целиком")
+CACHE_LOOKUPS = Counter("bot_summary_cache_total", "Обращения к кэшу частичных сводок", ["result"])
+
+CHUNK_PROMPT = (
+    "Ты — аналитический помощник. Твоя задача — составить краткую сводку переписки.\n"
+    "ЧАСТЬ {part}:\n\n"
+    "ПРАВИЛА:\n"
+    "1. Только ключевые факты и решения.\n"
+    "2. Нейтральный тон, без имен и приветствий.\n"
+    "3. Не более 3 предложений для этой части.\n\n"
+    "ТЕКСТ:\n{text}"
+)
+
+# Промежуточное слияние: сводки идут по порядку, хронологию нужно сохранить
+PARTIAL_MERGE_PROMPT = (
+    "Ты — аналитик. Перед тобой несколько последовательных кратких сводок одного канала.\n"
+    "Объедини их в одну сводку, сохранив хронологический порядок.\n"
+    "ПРАВИЛА:\n"
+    "- Не более 5 предложений.\n"
+    "- Исключи повторы.\n"
+    "ВВОДНЫЕ ДАННЫЕ:\n{text}"
+)
+
+FINAL_MERGE_PROMPT = (
+    "Ты — главный аналитик. Перед тобой несколько кратких сводок одного канала.\n"
+    "Объедини их в один связный финальный дайджест.\n"
+    "ПРАВИЛА:\n"
+    "- Строго не более 5 предложений.\n"
+    "- Исключи повторы.\n"
+    "ВВОДНЫЕ ДАННЫЕ:\n{text}"
+)
+
+# Финальный шаг инкрементальной сводки: предыдущий дайджест дополняется новыми событиями
+INCREMENTAL_MERGE_PROMPT = (
+    "Ты — главный аналитик. Ниже предыдущая сводка канала и краткие сводки новых сообщений.\n"
+    "Обнови дайджест: добавь новое, убери устаревшее и повторы.\n"
+    "ПРАВИЛА:\n"
+    "- Строго не более 5 предложений.\n"
+    "- Новые события важнее старых.\n"
+    "ПРЕДЫДУЩАЯ СВОДКА:\n{previous}\n\n"
+    "НОВЫЕ ДАННЫЕ:\n{text}"
+)
+
+
+class RateLimiter:
+    """Ограничивает частоту запросов: не больше rate запросов в секунду."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+async def _stream(prompt: str, on_progress: Callable[[str], Awaitable[None]]) -> str:
+    """Потоковая генерация с передачей накопленного текста в on_progress.
+
+    Если поток оборвался из-за временного сбоя, запрос повторяется обычным способом.
+    """
+    parts = []
+    try:
+        async for delta in stream_summary_async(prompt):
+            parts.append(delta)
+            await on_progress("".join(parts))
+        return "".join(parts)
+    except GigaChatTransientError as e:
+        logger.warning(f"Потоковая генерация прервана, повтор без потока: {e}")
+        result = await generate_summary_async(prompt)
+        await on_progress(result)
+        return result
+
+
+async def _gather_all(aws: list, what: str) -> list[str]:
+    """Дожидается всех запросов, даже если часть из них упала, и бросает первую ошибку.
+
+    Успевшие части уже лежат в кэше, поэтому повтор сводки запросит у GigaChat
+    только упавшие.
+    """
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        logger.warning(f"{what}: не получено {len(errors)} из {len(results)}, готовые сохранены в кэше")
+        raise errors[0]
+    return results
+
+
+async def _passthrough(summary: str) -> str:
+    return summary
 
-    # Если сообщений очень много, делим их на группы
-    chunks = []
-    current_chunk = []
-    current_length = 0
-
-    for msg in messages:
-        if current_length + len(msg) > MAX_CHARS:
-            chunks.append("\n".join(current_chunk))
-            current_chunk = [msg]
-            current_length = len(msg)
-        else:
-            current_chunk.append(msg)
-            current_length += len(msg)
-
-    if current_chunk:
-        chunks.append("\n".join(current_chunk))
-
-    # Суммаризируем каждый чанк
-    summaries = []
-    for i, chunk_text in enumerate(chunks):
-        prompt = (
-            "Ты — аналитический помощник. Твоя задача — составить краткую сводку переписки.\n"
-            f"ЧАСТЬ {i + 1} ИЗ {len(chunks)}:\n\n"
-            "ПРАВИЛА:\n"
-            "1. Только ключевые факты и решения.\n"
-            "2. Нейтральный тон, без имен и приветствий.\n"
-            "3. Не более 3 предложений для этой части.\n\n"
-            f"ТЕКСТ:\n{chunk_text}"
-        )
-        res = await generate_summary_async(prompt)
-        summaries.append(res)
-
-    # Если чанк был один — возвращаем его. Если много — делаем финальный проход.
-    final_text = "\n".join(summaries)
-    if len(chunks) == 1:
-        return final_text
-
-    final_prompt = (
-        "Ты — главный аналитик. Перед тобой несколько кратких сводок одного канала.\n"
-        "Объедини их в один связный финальный дайджест.\n"
-        "ПРАВИЛА:\n"
-        "- Строго не более 5 предложений.\n"
-        "- Исключи повторы.\n"
-        f"ВВОДНЫЕ ДАННЫЕ:\n{final_text}"
+
+def _group_for_merge(summaries: list[str], budget: int) -> list[list[str]]:
+    """Делит сводки на последовательные группы, каждая из которых влезает в budget токенов.
+
+    Сводка длиннее половины бюджета обрезается, поэтому любые две соседние
+    помещаются в одну группу и каждый уровень дерева уменьшает их количество.
+    Последняя группа может состоять из одной сводки — она переходит на
+    следующий уровень без слияния.
+    """
+    # Токены считаются вместе с переводом строки, которым сводки склеиваются в промпт
+    limit = max(budget // 2 - 1, 1)
+    groups = []
+    current = []
+    current_tokens = 0
+    for summary in summaries:
+        if estimate_tokens(summary) > limit:
+            logger.warning(f"Сводка части длиннее {limit} токенов, для слияния она обрезана")
+            summary = truncate_to_budget(summary, limit)
+        tokens = estimate_tokens(summary + "\n")
+        if current and current_tokens + tokens > budget:
+            groups.append(current)
+            current = []
+            current_tokens = 0
+        current.append(summary)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def summarize_messages(messages: Union[Iterable[str], AsyncIterable[str]],
+                             previous_summary: Optional[str] = None,
+                             on_progress: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+    """Сводка сообщений; если передана previous_summary, новые события вливаются в неё.
+
+    on_progress получает накопленный текст финальной сводки по мере её потоковой генерации.
+    """
+    started = time.perf_counter()
+    try:
+        return await _summarize(messages, previous_summary, on_progress)
+    finally:
+        SUMMARY_SECONDS.observe(time.perf_counter() - started)
+
+
+async def _summarize(messages, previous_summary, on_progress) -> str:
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    limiter = RateLimiter(MAX_RPS)
+
+    cache = get_cache()
+    hits_before, misses_before = cache.hits, cache.misses
+
+    async def generate(template: str, stream: bool = False, **fields) -> str:
+        # Ключ кэша не зависит от номера части — только от шаблона и текстов
+        key = cache.make_key(MODEL, template, "\0".join(
+            str(value) for name, value in sorted(fields.items()) if name != "part"
+        ))
+        cached = await cache.get(key)
+        CACHE_LOOKUPS.labels("miss" if cached is None else "hit").inc()
+        if cached is not None:
+            if stream:
+                await on_progress(cached)
+            return cached
+
+        async with semaphore:
+            await limiter.acquire()
+            if stream:
+                result = await _stream(template.format(**fields), on_progress)
+            else:
+                result = await generate_summary_async(template.format(**fields))
+        # Ошибки GigaChat пробрасываются: в кэш попадают только настоящие сводки
+        await cache.put(key, result)
+        return result
+
+    # Чанки нарезаются лениво: запрос по первому чанку уходит, пока читаются следующие.
+    # Чтение не убегает вперёд запросов больше чем на READ_AHEAD_CHUNKS чанков,
+    # поэтому длинный поток (например, большой файл) не оседает в памяти целиком
+    tasks = []
+    pending = set()
+    try:
+        async for chunk_text in aiter_chunks(messages, token_budget(MODEL, CHUNK_PROMPT)):
+            task = asyncio.create_task(generate(CHUNK_PROMPT, part=len(tasks) + 1, text=chunk_text))
+            tasks.append(task)
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            if len(pending) >= READ_AHEAD_CHUNKS:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        # gather сохраняет исходный порядок чанков
+        summaries = await _gather_all(tasks, "Сводки чанков")
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    SUMMARY_CHUNKS.observe(len(summaries))
+    logger.info(
+        f"Чанков: {len(summaries)}, кэш сводок: "
+        f"{cache.hits - hits_before} попаданий, {cache.misses - misses_before} промахов"
     )
-    return await generate_summary_async(final_prompt)
+
+    if not summaries:
+        return "Нет сообщений для суммаризации."
+
+    # Если чанк был один — возвращаем его. Если много — сливаем деревом.
+    if len(summaries) == 1 and not previous_summary:
+        if on_progress is not None:
+            await on_progress(summaries[0])
+        return summaries[0]
+
+    if previous_summary:
+        previous_limit = max(int(token_budget(MODEL, INCREMENTAL_MERGE_PROMPT) * PREVIOUS_SUMMARY_SHARE), 1)
+        if estimate_tokens(previous_summary) > previous_limit:
+            logger.warning(f"Предыдущая сводка длиннее {previous_limit} токенов, для слияния она обрезана")
+            previous_summary = truncate_to_budget(previous_summary, previous_limit)
+        merge_budget = token_budget(MODEL, INCREMENTAL_MERGE_PROMPT + previous_summary)
+    else:
+        merge_budget = token_budget(MODEL, PARTIAL_MERGE_PROMPT)
+    while True:
+        groups = _group_for_merge(summaries, merge_budget)
+        if len(groups) >= len(summaries) > 1:
+            # Бюджет слишком мал даже для пары сводок: новый уровень ничего не сократит
+            raise RuntimeError(f"Сводки не сливаются в окно из {merge_budget} токенов")
+        if len(groups) == 1:
+            # Финальный шаг — единственный, который имеет смысл показывать по мере генерации
+            stream = on_progress is not None
+            if previous_summary:
+                return await generate(INCREMENTAL_MERGE_PROMPT, stream=stream, previous=previous_summary,
+                                      text="\n".join(groups[0]))
+            return await generate(FINAL_MERGE_PROMPT, stream=stream, text="\n".join(groups[0]))
+
+        # Промежуточный уровень: сливаем соседние сводки, пока всё не влезет в одно окно
+        summaries = await _gather_all([
+            generate(PARTIAL_MERGE_PROMPT, text="\n".join(group)) if len(group) > 1 else _passthrough(group[0])
+            for group in groups
+        ], "Промежуточные слияния")
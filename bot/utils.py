@@ -1,7 +1,25 @@
+import asyncio
+import codecs
 import logging
+import mmap
 import sys
 from pathlib import Path
-import chardet
+from typing import AsyncIterator, Iterator
+from chardet.universaldetector import UniversalDetector
+
+# Кодировка определяется по началу файла: этого хватает и для больших выгрузок чатов
+ENCODING_SAMPLE_BYTES = 1024 * 1024
+# Файл декодируется блоками такого размера
+READ_BLOCK_BYTES = 256 * 1024
+MIN_CONFIDENCE = 0.6
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
 
 
 def setup_logger():
@@ -21,24 +39,96 @@ def setup_logger():
     return logger
 
 
-def read_text_from_file(path: str) -> str:
+def _resolve(path) -> Path:
     file_path = Path(path).resolve()
-
     if not file_path.exists():
         raise RuntimeError(f"Файл не найден: {file_path}")
+    return file_path
+
+
+def _map(f):
+    # Пустой файл отобразить в память нельзя
+    if f.seek(0, 2) == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
 
-    raw = file_path.read_bytes()
-    detected = chardet.detect(raw)
+def detect_encoding(path, sample_size: int = ENCODING_SAMPLE_BYTES) -> tuple[str, float]:
+    """Кодировка файла по первым sample_size байтам: (encoding, confidence).
 
-    encoding = detected.get("encoding")
-    confidence = detected.get("confidence", 0)
+    Детектор получает данные блоками и останавливается, как только уверен.
+    """
+    file_path = _resolve(path)
+    with open(file_path, "rb") as f:
+        mapped = _map(f)
+        if mapped is None:
+            return "utf-8", 1.0
+        with mapped:
+            head = mapped[:4]
+            for bom, encoding in _BOMS:
+                if head.startswith(bom):
+                    return encoding, 1.0
 
-    if not encoding or confidence < 0.6:
+            detector = UniversalDetector()
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, min(len(mapped), sample_size), READ_BLOCK_BYTES):
+                    detector.feed(view[offset:min(offset + READ_BLOCK_BYTES, sample_size)])
+                    if detector.done:
+                        break
+            finally:
+                view.release()
+            detector.close()
+
+    encoding = detector.result.get("encoding")
+    confidence = detector.result.get("confidence") or 0
+    # Если в начале файла одна латиница, дальше может встретиться что угодно из UTF-8
+    if encoding == "ascii":
+        encoding = "utf-8"
+    if not encoding or confidence < MIN_CONFIDENCE:
         raise RuntimeError(
             f"Не удалось уверенно определить кодировку файла {file_path} "
             f"(confidence={confidence})"
         )
+    return encoding, confidence
+
+
+def iter_text(path, encoding: str, block_size: int = READ_BLOCK_BYTES, errors: str = "replace") -> Iterator[str]:
+    """Декодирует файл блоками через mmap, не загружая его в память целиком."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    with open(_resolve(path), "rb") as f:
+        mapped = _map(f)
+        if mapped is None:
+            return
+        with mapped:
+            for offset in range(0, len(mapped), block_size):
+                # Многобайтный символ на границе блока декодер доберёт из следующего
+                yield decoder.decode(mapped[offset:offset + block_size])
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
 
-    text = raw.decode(encoding)
+async def aiter_lines(path, encoding: str, block_size: int = READ_BLOCK_BYTES) -> AsyncIterator[str]:
+    """Строки файла для нарезки на чанки; после каждого блока отдаёт управление циклу событий."""
+    rest = ""
+    for block in iter_text(path, encoding, block_size):
+        lines = (rest + block).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line
+        # Файл без переводов строк (например, JSON-выгрузка) не копится в памяти целиком
+        if len(rest) > block_size:
+            yield rest
+            rest = ""
+        await asyncio.sleep(0)
+    if rest:
+        yield rest
+
+
+def read_text_from_file(path: str) -> str:
+    file_path = _resolve(path)
+    encoding, confidence = detect_encoding(file_path)
+    text = "".join(iter_text(file_path, encoding, errors="strict"))
     print(f"📄 Файл прочитан: {file_path} (encoding={encoding}, confidence={confidence:.2f})")
     return text
@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# Модули бота импортируют друг друга по имени (как при запуске python bot/bot.py)
+root_dir = Path(__file__).resolve().parent.parent
+for path in (root_dir, root_dir / "bot"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
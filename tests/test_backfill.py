@@ -0,0 +1,133 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import scheduler
+from scheduler import SUMMARIZED, SummaryScheduler
+from tg_listener.backfill import CatchUp
+from tg_listener.db import Database, to_msk
+from tg_listener.ingest import MESSAGES_LOST, IngestionQueue
+
+BASE_DATE = datetime.datetime(2024, 5, 1, 9, 0, tzinfo=datetime.timezone.utc)
+
+
+def make_message(msg_id):
+    return SimpleNamespace(
+        id=msg_id, text=f"новость {msg_id}", action=None, sender_id=1,
+        date=BASE_DATE + datetime.timedelta(minutes=msg_id),
+    )
+
+
+class FakeClient:
+    """История канала из сообщений 1..last_id; iter_messages отдаёт от новых к старым, как Telethon."""
+
+    def __init__(self, last_id):
+        self.last_id = last_id
+
+    async def iter_messages(self, entity, min_id=0, offset_id=0, limit=None):
+        top = offset_id - 1 if offset_id else self.last_id
+        for count, msg_id in enumerate(range(top, min_id, -1)):
+            if limit is not None and count >= limit:
+                return
+            yield make_message(msg_id)
+
+
+class FakeListener:
+    def __init__(self, db, client, channels):
+        self.db = db
+        self.client = client
+        self.ingest = IngestionQueue(db)
+        self._channels = channels
+
+    def monitored_channels(self):
+        return self._channels
+
+    @staticmethod
+    def is_ignored(text):
+        return False
+
+
+async def make_channel(db):
+    await db.init_db()
+    channel = await db.add_channel("news", "Новости")
+    await db.set_channel_monitored(channel.id, True)
+    await db.set_channel_chat_id(channel.id, -1001)
+    return await db.get_channel_by_id(channel.id)
+
+
+def stored_row(listener, channel, msg_id):
+    message = make_message(msg_id)
+    return listener.ingest.build_row(channel.id, msg_id, message.sender_id, message.text, to_msk(message.date))
+
+
+def test_backfilled_gap_is_summarized_in_publication_order(tmp_path, monkeypatch):
+    received = {}
+
+    async def fake_summarize(texts, previous_summary=None, on_progress=None):
+        received["texts"] = texts
+        return "сводка"
+
+    async def deliver(channel, text, start, end):
+        received["delivered"] = (start, end)
+
+    monkeypatch.setattr(scheduler, "summarize_messages", fake_summarize)
+
+    async def scenario():
+        db = Database(f"sqlite+aiosqlite:///{tmp_path / 'backfill.db'}")
+        channel = await make_channel(db)
+        listener = FakeListener(db, FakeClient(last_id=20), [channel])
+        await db.save_messages([stored_row(listener, channel, i) for i in range(1, 6)])
+        last_ids = await db.get_last_msg_ids()
+        # Пока листенер догружает пропуск 6..19, вживую уже пришло сообщение 20
+        await db.save_messages([stored_row(listener, channel, 20)])
+
+        report = await CatchUp(listener, limit=100, batch_size=4).run(last_ids)
+        outcome = await SummaryScheduler(db, deliver).summarize_now(channel.id)
+        summaries = await db.get_summaries_page([channel.id])
+        unsummarized = await db.count_unsummarized(channel.id)
+        await db.engine.dispose()
+        return report, outcome, summaries, unsummarized, listener.ingest.stats()
+
+    report, outcome, summaries, unsummarized, ingest_stats = asyncio.run(scenario())
+    assert report["recovered"] == 14
+    # Догруженное не попадает в статистику живого приёма
+    assert ingest_stats["received"] == 0
+    assert outcome == SUMMARIZED
+    assert received["texts"] == [f"новость {i}" for i in range(1, 21)]
+    summary = summaries[0][0]
+    assert summary.range_start < summary.range_end
+    assert received["delivered"] == (summary.range_start, summary.range_end)
+    assert unsummarized == 0
+
+
+def test_failed_backfill_write_is_released_and_retried(tmp_path):
+    async def scenario():
+        db = Database(f"sqlite+aiosqlite:///{tmp_path / 'backfill.db'}")
+        channel = await make_channel(db)
+        listener = FakeListener(db, FakeClient(last_id=12), [channel])
+        listener.ingest.retries = 1
+        await db.save_messages([stored_row(listener, channel, i) for i in range(1, 3)])
+        last_ids = await db.get_last_msg_ids()
+
+        save_messages = db.save_messages
+
+        async def failing_save(rows):
+            raise RuntimeError("database is locked")
+
+        db.save_messages = failing_save
+        lost_before = MESSAGES_LOST.labels().value
+        failed = await CatchUp(listener, limit=100, batch_size=4).run(last_ids)
+        lost = MESSAGES_LOST.labels().value - lost_before
+        # Более новые пачки после ошибки не записаны: следующая догрузка начнёт с того же места
+        last_after_failure = await db.get_last_msg_ids()
+
+        db.save_messages = save_messages
+        retried = await CatchUp(listener, limit=100, batch_size=4).run(last_after_failure)
+        await db.engine.dispose()
+        return failed, lost, last_after_failure, retried
+
+    failed, lost, last_after_failure, retried = asyncio.run(scenario())
+    assert failed["recovered"] == 0
+    assert lost == 4
+    assert list(last_after_failure.values()) == [2]
+    assert retried["recovered"] == 10
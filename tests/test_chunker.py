@@ -0,0 +1,93 @@
+import asyncio
+from chunker import (
+    CHARS_PER_TOKEN, MODEL_CONTEXT_TOKENS, RESPONSE_RESERVE_TOKENS,
+    aiter_chunks, estimate_tokens, iter_chunks, split_oversized, token_budget,
+)
+
+PROMPT = "Сводка переписки.\nТЕКСТ:\n{text}"
+
+
+def test_no_empty_first_chunk():
+    # Первое сообщение больше бюджета не должно оставлять перед собой пустой чанк
+    budget = 20
+    messages = ["Очень длинное первое сообщение. " * 10, "второе"]
+    chunks = list(iter_chunks(messages, budget))
+    assert chunks
+    assert all(chunk.strip() for chunk in chunks)
+
+
+def test_empty_messages_are_skipped():
+    assert list(iter_chunks(["", "   ", "\n"], 50)) == []
+
+
+def test_budget_holds_with_prompt_overhead():
+    model = "GigaChat"
+    budget = token_budget(model, PROMPT)
+    messages = [f"Сообщение {i}: " + "слово " * (i % 40 + 1) for i in range(3000)]
+    chunks = list(iter_chunks(messages, budget))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        # Промпт целиком (шаблон + чанк) укладывается в контекст модели за вычетом запаса на ответ
+        assert estimate_tokens(chunk) <= budget
+        assert estimate_tokens(PROMPT) + estimate_tokens(chunk) <= MODEL_CONTEXT_TOKENS[model] - RESPONSE_RESERVE_TOKENS
+
+
+def test_all_messages_are_kept_in_order():
+    messages = [f"msg-{i}" for i in range(500)]
+    chunks = list(iter_chunks(messages, 30))
+    assert "\n".join(chunks).split("\n") == messages
+
+
+def test_oversized_message_split_on_sentence_boundaries():
+    sentences = [f"Предложение номер {i} о важном событии." for i in range(50)]
+    text = " ".join(sentences)
+    budget = 40
+    pieces = list(split_oversized(text, budget))
+    assert len(pieces) > 1
+    for piece in pieces:
+        assert estimate_tokens(piece) <= budget
+        # Каждый кусок начинается и заканчивается на границе предложения
+        assert piece.startswith("Предложение")
+        assert piece.endswith(".")
+    assert " ".join(pieces) == text
+
+
+def test_single_sentence_longer_than_budget_is_cut_by_length():
+    text = "а" * 1000
+    budget = 10
+    pieces = list(split_oversized(text, budget))
+    assert "".join(pieces) == text
+    assert all(len(piece) <= (budget - 1) * CHARS_PER_TOKEN for piece in pieces)
+
+
+def test_aiter_chunks_is_lazy():
+    consumed = 0
+
+    async def source():
+        nonlocal consumed
+        for i in range(1000):
+            consumed += 1
+            yield f"Сообщение {i}. " + "текст " * 20
+
+    async def first_chunk():
+        async for chunk in aiter_chunks(source(), 100):
+            return chunk
+
+    chunk = asyncio.run(first_chunk())
+    assert chunk
+    # Первый чанк готов, когда прочитан только следующий за ним фрагмент, а не весь поток
+    assert consumed < 20
+
+
+def test_aiter_chunks_matches_sync_version():
+    messages = [f"Сообщение {i}. " + "текст " * (i % 15) for i in range(300)]
+
+    async def source():
+        for msg in messages:
+            yield msg
+
+    async def collect(stream):
+        return [chunk async for chunk in aiter_chunks(stream, 60)]
+
+    assert asyncio.run(collect(source())) == list(iter_chunks(messages, 60))
+    assert asyncio.run(collect(messages)) == list(iter_chunks(messages, 60))
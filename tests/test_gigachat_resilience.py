@@ -0,0 +1,317 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+from multidict import CIMultiDict
+
+import gigachat
+import summary_service
+from gigachat import (
+    CircuitBreaker, CircuitOpenError, GigaChatClient, GigaChatPermanentError, GigaChatTransientError,
+    backoff_delay, classify_error,
+)
+from chunker import iter_chunks, token_budget
+from summary_cache import SummaryCache
+
+
+def http_error(status, headers=None):
+    return aiohttp.ClientResponseError(
+        None, (), status=status, message="error", headers=CIMultiDict(headers or {})
+    )
+
+
+class StubGigaChat:
+    """Заглушка GigaChat: отвечает по очереди статусами из statuses, дальше — успехом."""
+
+    def __init__(self, statuses=(), retry_after=None, fail_marker=None):
+        self.statuses = list(statuses)
+        self.retry_after = retry_after
+        # Запросы с этой подстрокой в тексте получают 400
+        self.fail_marker = fail_marker
+        self.tokens = 0
+        self.chat_requests = 0
+
+    async def oauth(self, request):
+        self.tokens += 1
+        return web.json_response({"access_token": f"token-{self.tokens}"})
+
+    async def chat(self, request):
+        self.chat_requests += 1
+        prompt = (await request.json())["messages"][-1]["content"]
+        status = self.statuses.pop(0) if self.statuses else 200
+        if status == 401:
+            return web.json_response({"message": "Unauthorized"}, status=401)
+        if self.fail_marker and self.fail_marker in prompt:
+            return web.json_response({"message": "Bad Request"}, status=400)
+        if status != 200:
+            headers = {"Retry-After": self.retry_after} if status == 429 and self.retry_after else None
+            return web.json_response({"message": "error"}, status=status, headers=headers)
+        return web.json_response({"choices": [{"message": {"content": f"сводка {self.chat_requests}"}}]})
+
+
+async def start(stub, monkeypatch):
+    app = web.Application()
+    app.router.add_post("/oauth", stub.oauth)
+    app.router.add_post("/chat", stub.chat)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    port = runner.addresses[0][1]
+    monkeypatch.setattr(gigachat, "OAUTH_URL", f"http://127.0.0.1:{port}/oauth")
+    monkeypatch.setattr(gigachat, "CHAT_URL", f"http://127.0.0.1:{port}/chat")
+    client = GigaChatClient(client_id="test", client_secret="test")
+    monkeypatch.setattr(gigachat, "_client", client)
+    return runner, client
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Паузы между повторами записываются, а не выжидаются."""
+    recorded = []
+
+    def fake_backoff(attempt, retry_after=None):
+        recorded.append((attempt, retry_after))
+        return 0.0
+
+    monkeypatch.setattr(gigachat, "backoff_delay", fake_backoff)
+    return recorded
+
+
+class FakeClock:
+    """Подменяет модуль time внутри gigachat: monotonic() двигается вручную."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return time.time()
+
+
+@pytest.mark.parametrize("status", [408, 429, 500, 502, 503])
+def test_retryable_statuses_are_transient(status):
+    assert isinstance(classify_error(http_error(status)), GigaChatTransientError)
+
+
+@pytest.mark.parametrize("status", [400, 401, 403, 404, 422])
+def test_client_errors_are_permanent(status):
+    assert isinstance(classify_error(http_error(status)), GigaChatPermanentError)
+
+
+def test_network_and_malformed_responses_are_transient():
+    for error in (asyncio.TimeoutError(), aiohttp.ClientConnectionError("reset"), KeyError("choices"),
+                  ValueError("Expecting value")):
+        assert isinstance(classify_error(error), GigaChatTransientError)
+    assert isinstance(classify_error(RuntimeError("bug")), GigaChatPermanentError)
+
+
+def test_retry_after_is_parsed_from_seconds_and_http_date():
+    assert classify_error(http_error(429, {"Retry-After": "7"})).retry_after == 7
+    date = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+    assert 25 < classify_error(http_error(429, {"Retry-After": date})).retry_after <= 30
+    assert classify_error(http_error(429)).retry_after is None
+
+
+def test_backoff_is_jittered_and_capped():
+    for attempt in range(1, 8):
+        delays = [backoff_delay(attempt, base=1, cap=10) for _ in range(200)]
+        assert all(0 <= delay <= min(10, 2 ** (attempt - 1)) for delay in delays)
+        assert len(set(delays)) > 100
+    assert max(backoff_delay(30, base=1, cap=10) for _ in range(200)) <= 10
+
+
+def test_backoff_honours_retry_after():
+    delays = [backoff_delay(1, retry_after=5, base=1, cap=2) for _ in range(200)]
+    assert all(5 <= delay <= 6 for delay in delays)
+
+
+def test_breaker_opens_probes_and_closes(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(gigachat, "time", clock)
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+
+    for _ in range(2):
+        breaker.before_request()
+        breaker.record_failure(GigaChatTransientError("HTTP 503"))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.before_request()
+    breaker.record_failure(GigaChatTransientError("HTTP 503"))
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError) as rejected:
+        breaker.before_request()
+    assert rejected.value.retry_after == 30
+
+    clock.now += 30
+    breaker.before_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Пока пробный запрос не вернулся, остальные отклоняются
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_request()
+
+
+def test_failed_probe_reopens_breaker(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(gigachat, "time", clock)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure(GigaChatTransientError("timeout"))
+    clock.now += 30
+    breaker.before_request()
+    breaker.record_failure(GigaChatTransientError("timeout"))
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_rate_limits_and_permanent_errors_do_not_trip_breaker():
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_failure(GigaChatTransientError("HTTP 429", retry_after=1))
+    breaker.record_failure(GigaChatPermanentError("HTTP 400"))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_complete_retries_transient_errors(monkeypatch, delays):
+    stub = StubGigaChat(statuses=[500, 429, 503], retry_after="2")
+
+    async def scenario():
+        runner, client = await start(stub, monkeypatch)
+        try:
+            return await client.complete("текст"), client.retries
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    result, retries = asyncio.run(scenario())
+    assert result == "сводка 4"
+    assert retries == 3
+    assert delays == [(1, None), (2, 2.0), (3, None)]
+
+
+def test_complete_refreshes_revoked_token(monkeypatch, delays):
+    stub = StubGigaChat(statuses=[401])
+
+    async def scenario():
+        runner, client = await start(stub, monkeypatch)
+        try:
+            return await client.complete("текст"), client.token_requests
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    result, token_requests = asyncio.run(scenario())
+    assert result == "сводка 2"
+    assert token_requests == 2
+    assert delays == []
+
+
+def test_complete_does_not_retry_permanent_errors(monkeypatch, delays):
+    stub = StubGigaChat(statuses=[400])
+
+    async def scenario():
+        runner, client = await start(stub, monkeypatch)
+        try:
+            with pytest.raises(GigaChatPermanentError):
+                await client.complete("текст")
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+    assert stub.chat_requests == 1
+
+
+def test_complete_stops_at_deadline(monkeypatch):
+    stub = StubGigaChat(statuses=[500] * 100)
+    monkeypatch.setattr(gigachat, "backoff_delay", lambda attempt, retry_after=None: 0.3)
+
+    async def scenario():
+        runner, client = await start(stub, monkeypatch)
+        started = time.monotonic()
+        try:
+            with pytest.raises(GigaChatTransientError):
+                await client.complete("текст", deadline=2, max_attempts=100)
+            return time.monotonic() - started
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    elapsed = asyncio.run(scenario())
+    # Очередная пауза и секунда на попытку уже не влезают в срок — повторы прекращаются до него
+    assert elapsed < 2
+    assert 1 < stub.chat_requests < 100
+
+
+def test_complete_fails_fast_while_breaker_is_open(monkeypatch, delays):
+    stub = StubGigaChat(statuses=[500] * 10)
+
+    async def scenario():
+        runner, client = await start(stub, monkeypatch)
+        client.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        try:
+            with pytest.raises(CircuitOpenError):
+                await client.complete("текст", max_attempts=10)
+            requests = stub.chat_requests
+            with pytest.raises(CircuitOpenError):
+                await client.complete("текст")
+            return requests
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    requests = asyncio.run(scenario())
+    assert requests == 2
+    assert stub.chat_requests == 2
+
+
+def test_gather_all_waits_for_every_request_and_raises_first_error():
+    finished = []
+
+    async def ok(name, delay):
+        await asyncio.sleep(delay)
+        finished.append(name)
+        return name
+
+    async def failing():
+        raise GigaChatPermanentError("HTTP 400")
+
+    with pytest.raises(GigaChatPermanentError):
+        asyncio.run(summary_service._gather_all([ok("a", 0.05), failing(), ok("b", 0.1)], "тест"))
+    assert sorted(finished) == ["a", "b"]
+
+
+def test_failed_chunk_is_the_only_one_requested_again(monkeypatch, tmp_path, delays):
+    stub = StubGigaChat(fail_marker="СБОЙ")
+    cache = SummaryCache(str(tmp_path / "cache.db"))
+    monkeypatch.setattr(summary_service, "get_cache", lambda: cache)
+    # Несколько чанков; в одном из них сообщение, на которое заглушка отвечает 400
+    messages = [f"Сообщение {i}: " + "событие дня " * 10 for i in range(600)]
+    messages[300] = "СБОЙ"
+    chunks = len(list(iter_chunks(messages, token_budget(gigachat.MODEL, summary_service.CHUNK_PROMPT))))
+
+    async def scenario():
+        runner, client = await start(stub, monkeypatch)
+        try:
+            with pytest.raises(GigaChatPermanentError):
+                await summary_service.summarize_messages(messages)
+            first_run = stub.chat_requests
+            stub.fail_marker = None
+            result = await summary_service.summarize_messages(messages)
+            return first_run, stub.chat_requests - first_run, result
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    first_run, second_run, result = asyncio.run(scenario())
+    cache.close()
+    assert chunks > 2
+    assert first_run == chunks
+    # Повтор: только упавший чанк и финальное слияние
+    assert second_run == 2
+    assert result.startswith("сводка")
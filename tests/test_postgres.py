@@ -0,0 +1,150 @@
+"""Проверка PostgreSQL-бэкенда на живой БД.
+
+Запускается, только если задан TEST_DATABASE_URL, например
+    TEST_DATABASE_URL=postgresql+asyncpg://postgres@localhost:5432/tg_test python -m pytest -q tests/test_postgres.py
+Все таблицы этой БД пересоздаются — не указывайте рабочую базу.
+"""
+import asyncio
+import datetime
+import os
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+
+pytestmark = pytest.mark.skipif(
+    not TEST_DATABASE_URL.startswith("postgresql"), reason="TEST_DATABASE_URL с PostgreSQL не задан"
+)
+
+if TEST_DATABASE_URL.startswith("postgresql"):
+    pytest.importorskip("asyncpg")
+
+from sqlalchemy import inspect, text  # noqa: E402
+import tg_listener.db as dbmod  # noqa: E402
+from tg_listener.db import Base, Database, Message, msk_now  # noqa: E402
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def fresh_db(partitioned: bool) -> Database:
+    dbmod.DB_PARTITION_MESSAGES = partitioned
+    db = Database(TEST_DATABASE_URL)
+    async with db.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await db.init_db()
+    return db
+
+
+def make_rows(channel_id, ids, date=None, text="сообщение"):
+    date = date or msk_now().replace(microsecond=0)
+    return [
+        {"msg_id": i, "chat_id": channel_id, "sender": "1", "text": f"{text} {i}", "date": date,
+         "is_summarized": False}
+        for i in ids
+    ]
+
+
+@pytest.fixture(params=[False, True], ids=["plain", "partitioned"])
+def partitioned(request):
+    yield request.param
+    dbmod.DB_PARTITION_MESSAGES = False
+
+
+def test_messages_table_matches_model(partitioned):
+    async def scenario():
+        db = await fresh_db(partitioned)
+        # Повторный запуск на существующей схеме (миграции, индексы, секции) ничего не ломает
+        await db.init_db()
+        async with db.engine.connect() as conn:
+            columns = await conn.run_sync(lambda c: {
+                col["name"]: (str(col["type"]), col["nullable"]) for col in inspect(c).get_columns("messages")
+            })
+            is_partitioned = (await conn.execute(text(
+                "SELECT count(*) FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+                "WHERE c.relname = 'messages'"
+            ))).scalar()
+        await db.engine.dispose()
+        return columns, is_partitioned
+
+    columns, is_partitioned = run(scenario())
+    assert set(columns) == {column.name for column in Message.__table__.columns}
+    assert columns["chat_id"][0] == "INTEGER" and columns["simhash"][0] == "BIGINT"
+    assert is_partitioned == int(partitioned)
+
+
+def test_save_messages_small_and_copy_batches(partitioned):
+    async def scenario():
+        db = await fresh_db(partitioned)
+        channel = await db.add_channel("pg", "PG")
+        # Дата одна на все пачки: в секционированной таблице уникальный ключ включает date,
+        # а повтор сообщения из Telegram приходит с той же датой
+        date = msk_now().replace(microsecond=0)
+        small = await db.save_messages(make_rows(channel.id, range(1, 11), date))
+        # Повторы (chat_id, msg_id) пропускаются и в малой пачке, и в COPY
+        again = await db.save_messages(make_rows(channel.id, range(5, 16), date))
+        big = await db.save_messages(make_rows(channel.id, range(1, dbmod.PG_COPY_THRESHOLD + 101), date))
+        # Вторая COPY-пачка подряд: временная таблица предыдущей транзакции уже удалена
+        big_again = await db.save_messages(make_rows(channel.id, range(1, dbmod.PG_COPY_THRESHOLD + 201), date))
+        stats = (await db.get_channel_stats())[channel.id]
+        stored = await db.get_stored_msg_ids(channel.id, [1, 15, 10_000])
+        await db.engine.dispose()
+        return small, again, big, big_again, stats, stored
+
+    small, again, big, big_again, stats, stored = run(scenario())
+    assert (small, again) == (10, 5)
+    assert big == dbmod.PG_COPY_THRESHOLD + 100 - 15
+    assert big_again == 100
+    assert stats.total == dbmod.PG_COPY_THRESHOLD + 200
+    assert stored == {1, 15}
+
+
+def test_partitions_hold_old_and_current_rows():
+    async def scenario():
+        db = await fresh_db(True)
+        created_again = await db.ensure_partitions()
+        channel = await db.add_channel("pg", "PG")
+        old = datetime.datetime(2015, 3, 1, 12, 0)
+        await db.save_messages(make_rows(channel.id, range(1, 301), date=old))
+        await db.save_messages(make_rows(channel.id, range(301, 311)))
+        async with db.engine.connect() as conn:
+            placement = dict((await conn.execute(text(
+                "SELECT tableoid::regclass::text, count(*) FROM messages GROUP BY 1"
+            ))).all())
+        await db.engine.dispose()
+        return created_again, placement
+
+    created_again, placement = run(scenario())
+    assert created_again == 0
+    assert placement["messages_default"] == 300
+    assert placement[f"messages_{msk_now():%Y_%m}"] == 10
+
+
+def test_search_watermark_and_archive(partitioned):
+    async def scenario():
+        db = await fresh_db(partitioned)
+        channel = await db.add_channel("pg", "PG")
+        await db.save_messages(make_rows(channel.id, range(1, 6), text="ключевая ставка ЦБ"))
+        await db.save_messages(make_rows(channel.id, range(6, 9), text="погода в Москве"))
+        found = await db.search("ставки")
+        messages = await db.get_unsummarized_messages(channel.id)
+        now = msk_now()
+        await db.save_summary(channel.id, "Итог про ставку", messages[0].date, messages[-1].date, messages[4].id)
+        unsummarized = await db.count_unsummarized(channel.id)
+        page = await db.get_messages_page([channel.id], start=now - datetime.timedelta(days=1), limit=3)
+        counted = await db.count_messages([channel.id], start=now - datetime.timedelta(days=1), summarized=True)
+        archivable = await db.get_archivable_messages(channel.id, now + datetime.timedelta(days=1), 100)
+        deleted = await db.delete_archived_messages(channel.id, [m.id for m in archivable])
+        stats = (await db.get_channel_stats())[channel.id]
+        await db.vacuum()
+        await db.engine.dispose()
+        return found, unsummarized, page, counted, deleted, stats
+
+    found, unsummarized, page, counted, deleted, stats = run(scenario())
+    assert len(found) == 5
+    assert all(dbmod.FTS_MARK_START in item["snippet"] for item in found)
+    assert unsummarized == 3
+    assert len(page) == 4  # limit + 1: есть следующая страница
+    assert counted == 5
+    assert deleted == 5
+    assert (stats.total, stats.summarized) == (3, 0)
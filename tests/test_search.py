@@ -0,0 +1,66 @@
+import asyncio
+import datetime
+
+import tg_listener.db as dbmod
+from tg_listener.db import FTS_MARK_END, FTS_MARK_START, Database
+
+START = datetime.datetime(2024, 3, 1, 10, 0)
+
+
+async def make_db(path, texts):
+    db = Database(f"sqlite+aiosqlite:///{path}")
+    await db.init_db()
+    channel = await db.add_channel("news", "Новости")
+    await db.save_messages([
+        {"msg_id": i, "chat_id": channel.id, "sender": "1", "text": text,
+         "date": START + datetime.timedelta(minutes=i), "is_summarized": False}
+        for i, text in enumerate(texts, start=1)
+    ])
+    return db
+
+
+def test_search_ranks_and_highlights(tmp_path):
+    texts = ["Погода в Москве", "Ставка ЦБ: ставка сохранена, ставки по вкладам растут",
+             "ЦБ сохранил ключевую ставку", "Курс рубля"]
+
+    async def scenario():
+        db = await make_db(tmp_path / "search.db", texts)
+        found = await db.search("ставки")
+        none = await db.search("биткоин")
+        await db.engine.dispose()
+        return found, none
+
+    found, none = asyncio.run(scenario())
+    assert [item["id"] for item in found] == [2, 3]
+    assert found[0]["channel"] == "Новости"
+    assert found[0]["date"] == START + datetime.timedelta(minutes=2)
+    assert f"{FTS_MARK_START}Ставка{FTS_MARK_END}" in found[0]["snippet"]
+    assert none == []
+
+
+def test_search_pages_return_extra_row(tmp_path):
+    async def scenario():
+        db = await make_db(tmp_path / "search.db", [f"новость: рынок {i}" for i in range(7)])
+        first = await db.search("рынок", limit=3)
+        last = await db.search("рынок", limit=3, offset=6)
+        await db.engine.dispose()
+        return first, last
+
+    first, last = asyncio.run(scenario())
+    assert len(first) == 4
+    assert len(last) == 1
+
+
+def test_search_ranks_only_newest_candidates(tmp_path, monkeypatch):
+    monkeypatch.setattr(dbmod, "SEARCH_CANDIDATES", 5)
+    # Самое релевантное совпадение — старое и за пределами кандидатов
+    texts = ["рынок рынок рынок рынок"] + [f"новость {i}, рынок и прочее" for i in range(10)]
+
+    async def scenario():
+        db = await make_db(tmp_path / "search.db", texts)
+        found = await db.search("рынок", limit=20)
+        await db.engine.dispose()
+        return found
+
+    found = asyncio.run(scenario())
+    assert sorted(item["id"] for item in found) == [7, 8, 9, 10, 11]
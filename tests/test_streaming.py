@@ -0,0 +1,212 @@
+import asyncio
+import importlib
+import json
+
+import pytest
+from aiohttp import web
+
+import gigachat
+import summary_service
+from gigachat import GigaChatClient, GigaChatTransientError
+from summary_cache import SummaryCache
+
+REPLY = "Итог: ставка сохранена, рынок спокоен."
+
+
+def sse(content: str) -> bytes:
+    chunk = {"choices": [{"delta": {"content": content}, "index": 0}]}
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class StubGigaChat:
+    """Заглушка GigaChat: поток отдаётся заданными кусками байтов, а не целыми строками."""
+
+    def __init__(self, fragments=(), fail_after=None):
+        self.fragments = list(fragments)
+        # "drop" — оборвать соединение, "broken" — прислать испорченный JSON после fail_after кусков
+        self.fail_after = fail_after
+        self.failure = None
+        self.requests = {"stream": 0, "complete": 0}
+
+    async def oauth(self, request):
+        return web.json_response({"access_token": "token"})
+
+    async def chat(self, request):
+        payload = await request.json()
+        if not payload.get("stream"):
+            self.requests["complete"] += 1
+            return web.json_response({"choices": [{"message": {"content": REPLY}}]})
+
+        self.requests["stream"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for number, fragment in enumerate(self.fragments):
+            if number == self.fail_after:
+                if self.failure == "drop":
+                    request.transport.close()
+                    return response
+                await response.write(b'data: {"choices": [{"delta"\n\n')
+                break
+            await response.write(fragment)
+            # Пауза, чтобы куски пришли клиенту раздельно
+            await asyncio.sleep(0.01)
+        await response.write_eof()
+        return response
+
+
+async def start(stub, monkeypatch):
+    app = web.Application()
+    app.router.add_post("/oauth", stub.oauth)
+    app.router.add_post("/chat", stub.chat)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    monkeypatch.setattr(gigachat, "OAUTH_URL", f"http://127.0.0.1:{port}/oauth")
+    monkeypatch.setattr(gigachat, "CHAT_URL", f"http://127.0.0.1:{port}/chat")
+    client = GigaChatClient(client_id="test", client_secret="test")
+    monkeypatch.setattr(gigachat, "_client", client)
+    return runner, client
+
+
+def test_stream_reassembles_split_lines_and_stops_at_done(monkeypatch):
+    body = b": keep-alive\n\n" + sse("Итог: ставка ") + sse("сохранена.") + b"data: [DONE]\n\n" + sse("лишнее")
+    # Куски режут строки SSE посередине, в том числе внутри многобайтового символа
+    fragments = [body[i:i + 7] for i in range(0, len(body), 7)]
+    stub = StubGigaChat(fragments)
+
+    async def scenario():
+        runner, client = await start(stub, monkeypatch)
+        try:
+            return [delta async for delta in client.stream("текст")], client.breaker.failures
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    deltas, failures = asyncio.run(scenario())
+    assert deltas == ["Итог: ставка ", "сохранена."]
+    assert failures == 0
+
+
+@pytest.mark.parametrize("failure", ["drop", "broken"])
+def test_stream_error_midway_is_transient(monkeypatch, failure):
+    stub = StubGigaChat([sse("Итог: "), sse("ставка "), sse("сохранена.")], fail_after=2)
+    stub.failure = failure
+
+    async def scenario():
+        runner, client = await start(stub, monkeypatch)
+        deltas = []
+        try:
+            with pytest.raises(GigaChatTransientError):
+                async for delta in client.stream("текст"):
+                    deltas.append(delta)
+            return deltas, client.breaker.failures
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    deltas, failures = asyncio.run(scenario())
+    assert deltas == ["Итог: ", "ставка "]
+    assert failures == 1
+
+
+def test_broken_stream_falls_back_to_complete(monkeypatch):
+    stub = StubGigaChat([sse("Итог: "), sse("ставка "), sse("сохранена.")], fail_after=2)
+    stub.failure = "drop"
+    progress = []
+
+    async def on_progress(text):
+        progress.append(text)
+
+    async def scenario():
+        runner, client = await start(stub, monkeypatch)
+        try:
+            return await summary_service._stream("промпт", on_progress)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    result = asyncio.run(scenario())
+    assert result == REPLY
+    assert progress == ["Итог: ", "Итог: ставка ", REPLY]
+    assert stub.requests == {"stream": 1, "complete": 1}
+
+
+def test_summarize_messages_streams_final_step(monkeypatch, tmp_path):
+    stub = StubGigaChat([sse("Новый "), sse("дайджест."), b"data: [DONE]\n\n"])
+    cache = SummaryCache(str(tmp_path / "cache.db"))
+    monkeypatch.setattr(summary_service, "get_cache", lambda: cache)
+    progress = []
+
+    async def on_progress(text):
+        progress.append(text)
+
+    async def scenario():
+        runner, client = await start(stub, monkeypatch)
+        try:
+            return await summary_service.summarize_messages(
+                ["Банк сохранил ставку.", "Рубль укрепился."], previous_summary="Старый дайджест.",
+                on_progress=on_progress,
+            )
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    result = asyncio.run(scenario())
+    cache.close()
+    # Сводка чанка — обычным запросом, финальное слияние с прошлой сводкой — потоком
+    assert stub.requests == {"stream": 1, "complete": 1}
+    assert result == "Новый дайджест."
+    assert progress == ["Новый ", "Новый дайджест."]
+
+
+@pytest.fixture
+def bot_module(monkeypatch):
+    monkeypatch.setenv("BOT_TOKEN", "123:test")
+    module = importlib.import_module("bot")
+    edits = []
+
+    class FakeBot:
+        fail_markdown = False
+
+        async def edit_message_text(self, text, chat_id, message_id, parse_mode=None):
+            if parse_mode and self.fail_markdown:
+                raise RuntimeError("can't parse entities")
+            edits.append((text, parse_mode))
+
+    fake = FakeBot()
+    monkeypatch.setattr(module, "bot", fake)
+    return module, fake, edits
+
+
+def test_progressive_message_rate_limits_edits(bot_module):
+    module, _, edits = bot_module
+
+    async def scenario():
+        message = module.ProgressiveMessage(1, 2, "⏳ ", min_interval=0.2)
+        await message.update("Итог")
+        await message.update("Итог: ставка")
+        await message.update("Итог: ставка сохранена")
+        await asyncio.sleep(0.25)
+        await message.update("Итог: ставка сохранена.")
+        await message.finish("**Итог**")
+
+    asyncio.run(scenario())
+    assert edits == [
+        ("⏳ Итог ▌", None),
+        ("⏳ Итог: ставка сохранена. ▌", None),
+        ("**Итог**", "Markdown"),
+    ]
+
+
+def test_progressive_message_finish_falls_back_to_plain_text(bot_module):
+    module, fake, edits = bot_module
+    fake.fail_markdown = True
+
+    async def scenario():
+        message = module.ProgressiveMessage(1, 2, "⏳ ", min_interval=0)
+        await message.finish("**Итог** с _незакрытой разметкой")
+
+    asyncio.run(scenario())
+    assert edits == [("**Итог** с _незакрытой разметкой", None)]
@@ -0,0 +1,60 @@
+import asyncio
+import random
+
+import pytest
+
+import summary_service
+from chunker import MODEL_CONTEXT_TOKENS, RESPONSE_RESERVE_TOKENS, estimate_tokens
+from summary_cache import SummaryCache
+
+
+@pytest.fixture
+def prompts(monkeypatch, tmp_path):
+    """GigaChat подменяется: каждый промпт записывается, ответ — короткая сводка."""
+    sent = []
+
+    async def fake_generate(prompt):
+        sent.append(prompt)
+        return f"Сводка {len(sent)}."
+
+    cache = SummaryCache(str(tmp_path / "cache.db"))
+    monkeypatch.setattr(summary_service, "generate_summary_async", fake_generate)
+    monkeypatch.setattr(summary_service, "get_cache", lambda: cache)
+    monkeypatch.setattr(summary_service, "MAX_RPS", 0)
+    yield sent
+    cache.close()
+
+
+def test_groups_fit_budget_and_shrink_every_level():
+    rnd = random.Random(7)
+    for _ in range(200):
+        budget = rnd.randint(3, 400)
+        summaries = ["слово " * rnd.randint(0, 300) for _ in range(rnd.randint(2, 40))]
+        groups = summary_service._group_for_merge(summaries, budget)
+        assert all(sum(estimate_tokens(s + "\n") for s in group) <= budget for group in groups)
+        assert len(groups) < len(summaries)
+
+
+def test_long_previous_summary_is_truncated(prompts):
+    messages = [f"Сообщение {i}: " + "событие дня " * 10 for i in range(400)]
+    previous = "Очень подробная прошлая сводка. " * 2000
+
+    result = asyncio.run(asyncio.wait_for(
+        summary_service.summarize_messages(messages, previous_summary=previous), timeout=10
+    ))
+
+    assert result.startswith("Сводка")
+    context = MODEL_CONTEXT_TOKENS["GigaChat"] - RESPONSE_RESERVE_TOKENS
+    assert all(estimate_tokens(prompt) <= context for prompt in prompts)
+    final = prompts[-1]
+    assert "ПРЕДЫДУЩАЯ СВОДКА" in final
+    assert estimate_tokens(final) <= context
+
+
+def test_merge_stops_when_budget_is_too_small(prompts, monkeypatch):
+    budgets = iter([50, 1])
+    monkeypatch.setattr(summary_service, "token_budget", lambda model, template: next(budgets))
+    messages = [f"Сообщение {i}: " + "событие дня " * 10 for i in range(20)]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(asyncio.wait_for(summary_service.summarize_messages(messages), timeout=10))
@@ -0,0 +1,208 @@
+"""Архив старых сообщений: сжатые JSONL-сегменты, разложенные по каналам и месяцам.
+
+    python -m tg_listener.archive run
+    python -m tg_listener.archive export @channel --from 2024-01-01 --to 2024-03-31 > out.jsonl
+    python -m tg_listener.archive vacuum
+"""
+import argparse
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+from tg_listener.db import BASE_DIR, Database, msk_now
+
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", str(BASE_DIR / "archive")))
+# Через сколько дней сводные сообщения уходят в архив, если у канала не задано своё (0 — никогда)
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "90"))
+# Сколько сообщений переносится и удаляется за одну транзакцию
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+
+def _serialize(message) -> dict:
+    return {
+        "id": message.id,
+        "msg_id": message.msg_id,
+        "chat_id": message.chat_id,
+        "sender": message.sender,
+        "text": message.text,
+        "date": message.date.isoformat() if message.date else None,
+        "simhash": message.simhash,
+        "is_duplicate": bool(message.is_duplicate),
+    }
+
+
+class Archiver:
+    """Переносит сообщения, уже вошедшие в сводку, из БД в архив и читает их обратно.
+
+    Сегмент — файл <канал>/<ГГГГ-ММ>/<первый id>-<последний id>.jsonl.gz.
+    Сначала сегмент целиком записывается на диск, и только потом строки удаляются из БД,
+    поэтому сбой посередине не теряет данных (в худшем случае сегмент перезапишется).
+    """
+
+    def __init__(self, db: Database, archive_dir: Path = ARCHIVE_DIR, default_days: int = RETENTION_DAYS,
+                 batch_size: int = ARCHIVE_BATCH_SIZE):
+        self.db = db
+        self.archive_dir = Path(archive_dir)
+        self.default_days = default_days
+        self.batch_size = batch_size
+
+    def retention_days(self, channel) -> int:
+        return channel.retention_days if channel.retention_days is not None else self.default_days
+
+    async def run(self) -> dict:
+        """Один проход по всем каналам: архивирует, удаляет из БД, освобождает место."""
+        started = time.perf_counter()
+        archived = 0
+        segments = 0
+        for channel in await self.db.get_all_channels():
+            days = self.retention_days(channel)
+            if days <= 0:
+                continue
+            cutoff = msk_now() - datetime.timedelta(days=days)
+            channel_archived, channel_segments = await self._archive_channel(channel.id, cutoff)
+            archived += channel_archived
+            segments += channel_segments
+
+        vacuumed = await self.db.incremental_vacuum() if archived else False
+        report = {
+            "archived": archived,
+            "segments": segments,
+            "vacuumed": vacuumed,
+            "seconds": time.perf_counter() - started,
+        }
+        if archived:
+            print(
+                f"🗄️ В архив перенесено сообщений: {archived} ({segments} сегм.) "
+                f"за {report['seconds']:.1f} с"
+            )
+            if not vacuumed:
+                print("ℹ️ Место в файле БД освободится после `python -m tg_listener.archive vacuum`")
+        return report
+
+    async def _archive_channel(self, channel_id: int, cutoff: datetime.datetime):
+        archived = segments = 0
+        while True:
+            messages = await self.db.get_archivable_messages(channel_id, cutoff, self.batch_size)
+            if not messages:
+                break
+            rows = [_serialize(m) for m in messages]
+            segments += len(await asyncio.to_thread(self._write_segments, channel_id, rows))
+            archived += await self.db.delete_archived_messages(channel_id, [row["id"] for row in rows])
+            if len(messages) < self.batch_size:
+                break
+            # Даём поработать записи новых сообщений между пачками
+            await asyncio.sleep(0)
+        return archived, segments
+
+    def _channel_dir(self, channel_id: int) -> Path:
+        return self.archive_dir / f"channel_{channel_id}"
+
+    def _write_segments(self, channel_id: int, rows: list[dict]) -> list[Path]:
+        by_month = {}
+        for row in rows:
+            by_month.setdefault((row["date"] or "")[:7] or "unknown", []).append(row)
+
+        paths = []
+        for month, month_rows in by_month.items():
+            directory = self._channel_dir(channel_id) / month
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"{month_rows[0]['id']:010d}-{month_rows[-1]['id']:010d}.jsonl.gz"
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "wb") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as gz:
+                    for row in month_rows:
+                        gz.write(json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n")
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(tmp, path)
+            paths.append(path)
+        return paths
+
+    def segment_paths(self, channel_id: int, start: Optional[datetime.datetime] = None,
+                      end: Optional[datetime.datetime] = None) -> list[Path]:
+        """Сегменты канала, месяцы которых пересекаются с [start, end)."""
+        channel_dir = self._channel_dir(channel_id)
+        if not channel_dir.exists():
+            return []
+        first = start.strftime("%Y-%m") if start else None
+        last = end.strftime("%Y-%m") if end else None
+        paths = []
+        for month_dir in sorted(channel_dir.iterdir()):
+            month = month_dir.name
+            if (first and month < first) or (last and month > last):
+                continue
+            paths.extend(sorted(month_dir.glob("*.jsonl.gz")))
+        return paths
+
+    def iter_archived(self, channel_id: int, start: Optional[datetime.datetime] = None,
+                      end: Optional[datetime.datetime] = None) -> Iterator[dict]:
+        """Архивные сообщения канала за период [start, end), по порядку сегментов."""
+        start_iso = start.isoformat() if start else None
+        end_iso = end.isoformat() if end else None
+        seen = set()
+        for path in self.segment_paths(channel_id, start, end):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    row = json.loads(line)
+                    date = row["date"] or ""
+                    if (start_iso and date < start_iso) or (end_iso and date >= end_iso):
+                        continue
+                    # Сегмент мог быть записан повторно после сбоя
+                    if row["id"] in seen:
+                        continue
+                    seen.add(row["id"])
+                    yield row
+
+    def export(self, channel_id: int, out, start: Optional[datetime.datetime] = None,
+               end: Optional[datetime.datetime] = None) -> int:
+        """Пишет архивный диапазон в out в виде JSONL. Возвращает число строк."""
+        count = 0
+        for row in self.iter_archived(channel_id, start, end):
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+        return count
+
+
+async def _cli(args):
+    db = Database()
+    await db.init_db()
+    archiver = Archiver(db)
+    try:
+        if args.command == "run":
+            report = await archiver.run()
+            print(f"Готово: {report['archived']} сообщений, {report['segments']} сегментов")
+        elif args.command == "vacuum":
+            print("⏳ VACUUM может занять время на большой БД...")
+            await db.vacuum()
+            print("✅ Готово, дальше место будет освобождаться автоматически")
+        elif args.command == "export":
+            channel = await db.get_channel_by_username(args.channel)
+            if channel is None:
+                sys.exit(f"Канал {args.channel} не найден")
+            start = datetime.datetime.fromisoformat(args.date_from) if args.date_from else None
+            end = datetime.datetime.fromisoformat(args.date_to) if args.date_to else None
+            count = archiver.export(channel.id, sys.stdout, start, end)
+            print(f"Выгружено сообщений: {count}", file=sys.stderr)
+    finally:
+        await db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("run", help="перенести старые сообщения в архив")
+    sub.add_parser("vacuum", help="сжать файл БД (разово для БД без auto_vacuum)")
+    export = sub.add_parser("export", help="выгрузить архив канала в JSONL")
+    export.add_argument("channel", help="username канала")
+    export.add_argument("--from", dest="date_from")
+    export.add_argument("--to", dest="date_to")
+    asyncio.run(_cli(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import time
+from typing import Optional
+from telethon import errors
+from tg_listener.db import to_msk
+from tg_listener.ingest import DB_WRITE_ERRORS, MESSAGES_LOST
+from tg_listener.metrics import Counter
+
+BACKFILL_MESSAGES = Counter("tg_listener_backfill_messages_total", "Пропущенных сообщений догружено из истории")
+BACKFILL_TRUNCATED = Counter(
+    "tg_listener_backfill_truncated_total",
+    "Догрузок канала, упёршихся в BACKFILL_LIMIT (старая часть пропуска не загружена)"
+)
+
+
+class CatchUp:
+    """Догрузка сообщений, пропущенных, пока листенер был выключен или без связи.
+
+    Для каждого отслеживаемого канала берётся наибольший сохранённый msg_id,
+    и всё, что новее, читается из истории Telegram (iter_messages) параллельно
+    по нескольким каналам — от новых к старым, чтобы при пропуске больше
+    BACKFILL_LIMIT терялись самые старые сообщения, а не свежие. Такой канал
+    попадает в отчёт. Записываются полученные сообщения уже от старых к новым:
+    id строк в БД идут в порядке публикации, а при ошибке записи более новые
+    пачки не пишутся, и следующая догрузка начнёт с того же места. Уже
+    сохранённые и только что принятые вживую сообщения в БД повторно не пишутся
+    и повтором самих себя не считаются.
+    """
+
+    def __init__(self, listener, concurrency=None, limit=None, batch_size=None, max_flood_wait=None):
+        self.listener = listener
+        self.concurrency = concurrency or int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+        # Не больше limit сообщений на канал за один проход (0 — догрузка выключена)
+        self.limit = limit if limit is not None else int(os.getenv("BACKFILL_LIMIT", "5000"))
+        self.batch_size = batch_size or int(os.getenv("BACKFILL_BATCH_SIZE", "200"))
+        # Дольше этого ждать FloodWait не будем — канал догрузится в следующий раз
+        self.max_flood_wait = max_flood_wait or int(os.getenv("BACKFILL_MAX_FLOOD_WAIT", "300"))
+        self._write_lock = asyncio.Lock()
+
+    async def run(self, last_ids: dict) -> dict:
+        """Догружает каналы; last_ids — {channel_id: msg_id}, снятые до подписки на новые сообщения."""
+        if not self.limit:
+            return {"recovered": 0, "fetched": 0, "channels": 0, "truncated": [], "seconds": 0.0}
+
+        started = time.perf_counter()
+        # Каналы без сохранённых сообщений не догружаем: для них нет точки отсчёта
+        channels = [ch for ch in self.listener.monitored_channels() if last_ids.get(ch.id)]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_channel(channel):
+            async with semaphore:
+                return await self._catch_up_channel(channel, last_ids[channel.id])
+
+        results = await asyncio.gather(*(run_channel(ch) for ch in channels))
+        report = {
+            "recovered": sum(inserted for _, inserted, _ in results),
+            "fetched": sum(fetched for fetched, _, _ in results),
+            "channels": len(channels),
+            "truncated": [ch.username for ch, (_, _, truncated) in zip(channels, results) if truncated],
+            "seconds": time.perf_counter() - started,
+        }
+        print(
+            f"⏪ Догружено пропущенных сообщений: {report['recovered']} "
+            f"(получено {report['fetched']}, каналов {report['channels']}) за {report['seconds']:.1f} с"
+        )
+        if report["truncated"]:
+            print(
+                f"⚠️ Догрузка упёрлась в BACKFILL_LIMIT={self.limit}, старая часть пропуска не загружена: "
+                + ", ".join(f"@{username}" for username in report["truncated"])
+            )
+        return report
+
+    async def _catch_up_channel(self, channel, last_msg_id: int):
+        client = self.listener.client
+        ingest = self.listener.ingest
+        entity = channel.chat_id or channel.username
+        fetched = inserted = 0
+        # Самый старый полученный id: после FloodWait продолжаем с него (offset_id — строго меньше)
+        oldest_id = 0
+        rows = []
+
+        while fetched < self.limit:
+            try:
+                # От новых к старым до last_msg_id: при большом пропуске важнее свежие сообщения
+                async for message in client.iter_messages(
+                    entity, min_id=last_msg_id, offset_id=oldest_id, limit=self.limit - fetched
+                ):
+                    oldest_id = message.id
+                    fetched += 1
+                    if message.action is not None or self.listener.is_ignored(message.text):
+                        continue
+                    rows.append(ingest.build_row(
+                        channel_id=channel.id,
+                        msg_id=message.id,
+                        sender_id=str(message.sender_id),
+                        text=message.text or "",
+                        date=to_msk(message.date),
+                    ))
+                break
+            except errors.FloodWaitError as e:
+                if e.seconds > self.max_flood_wait:
+                    print(f"⚠️ Догрузка @{channel.username} прервана: FloodWait {e.seconds} с")
+                    break
+                print(f"⏳ Догрузка @{channel.username}: FloodWait, ждём {e.seconds} с")
+                await asyncio.sleep(e.seconds + 1)
+            except Exception as e:
+                print(f"⚠️ Ошибка догрузки @{channel.username}: {e}")
+                break
+
+        # Получено от новых к старым, пишем от старых к новым пачками по batch_size
+        rows.reverse()
+        for start in range(0, len(rows), self.batch_size):
+            written = await self._write(rows[start:start + self.batch_size])
+            if written is None:
+                print(f"⚠️ Догрузка @{channel.username}: запись остановлена, остаток догрузится в следующий раз")
+                break
+            inserted += written
+
+        # Получили ровно limit и не дошли до last_msg_id: между ними могли остаться сообщения
+        truncated = fetched >= self.limit and oldest_id > last_msg_id + 1
+        if truncated:
+            BACKFILL_TRUNCATED.inc()
+            print(
+                f"⚠️ Догрузка @{channel.username}: не загружены сообщения "
+                f"с id {last_msg_id + 1}…{oldest_id - 1} (BACKFILL_LIMIT={self.limit})"
+            )
+        return fetched, inserted, truncated
+
+    async def _write(self, rows) -> Optional[int]:
+        """Пишет пачку догруженных строк; None, если запись не удалась после всех повторов."""
+        ingest = self.listener.ingest
+        # Уже сохранённые сообщения (например, принятые вживую во время догрузки) не пишем
+        # и через индекс повторов не пропускаем, иначе они стали бы повтором самих себя
+        stored = await self.listener.db.get_stored_msg_ids(rows[0]["chat_id"], [row["msg_id"] for row in rows])
+        rows = await ingest.annotate([row for row in rows if row["msg_id"] not in stored])
+        if not rows:
+            return 0
+        # Пишем по одной пачке за раз, чтобы не спорить за блокировку SQLite
+        async with self._write_lock:
+            for attempt in range(1, ingest.retries + 1):
+                try:
+                    inserted = await self.listener.db.save_messages(rows)
+                    BACKFILL_MESSAGES.inc(inserted)
+                    return inserted
+                except Exception as e:
+                    DB_WRITE_ERRORS.inc()
+                    print(f"⚠️ Ошибка записи догруженных сообщений ({len(rows)}, попытка {attempt}): {e}")
+                    if attempt < ingest.retries:
+                        await asyncio.sleep(0.5 * attempt)
+        # Не записанные сообщения снова можно принять — вживую или при следующей догрузке
+        ingest.release(rows)
+        MESSAGES_LOST.inc(len(rows))
+        return None
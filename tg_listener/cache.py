@@ -0,0 +1,141 @@
+"""Кэш отрисованных страниц панели и условные GET (ETag / Last-Modified).
+
+Страница зависит от наборов данных (каналы, сообщения, сводки). Их версии
+хранятся в таблице data_versions и растут в тех же транзакциях, что и сами
+данные, поэтому версии одинаковы для всех воркеров панели и демона приёма.
+ETag страницы — хеш адреса запроса и версий её наборов: пока версии не
+изменились, браузер получает 304, а другой клиент — готовый ответ из памяти
+без запросов к БД, кроме чтения версий.
+"""
+import datetime
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional
+import pytz
+from flask import Response, make_response, request
+from tg_listener.metrics import Counter, Gauge
+
+VIEW_CACHE_SIZE = int(os.getenv("VIEW_CACHE_SIZE", "256"))
+
+CACHE_REQUESTS = Counter(
+    "tg_web_cache_requests_total",
+    "Запросы к кэшируемым страницам по результату: hit, miss, not_modified",
+    ["view", "result"]
+)
+CACHE_HIT_RATIO = Gauge(
+    "tg_web_cache_hit_ratio", "Доля запросов страницы, обслуженных без отрисовки (hit и not_modified)", ["view"]
+)
+
+# Изменённые шаблоны должны давать новые ETag даже при тех же данных
+_TEMPLATES_STAMP = str(max(
+    (path.stat().st_mtime_ns for path in (Path(__file__).parent / "templates").glob("*.html")), default=0
+))
+
+
+def _to_utc(moment: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    """Московское naive-время из БД -> UTC для заголовка Last-Modified (с точностью до секунды)."""
+    if moment is None:
+        return None
+    return pytz.timezone("Europe/Moscow").localize(moment).astimezone(pytz.utc).replace(microsecond=0)
+
+
+class ResponseCache:
+    """LRU-кэш ответов GET по адресу запроса, проверяемый по версиям данных."""
+
+    def __init__(self, get_db: Callable, max_entries: int = VIEW_CACHE_SIZE):
+        # БД берётся при каждом запросе: панель может подменить её (например, бенчмарк)
+        self.get_db = get_db
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # адрес -> (etag, тело, mimetype)
+        # Маршруты Flask выполняются в разных потоках
+        self._lock = threading.Lock()
+        self._counts = {}  # view -> [без отрисовки, всего]
+
+    def hit_ratio(self, view: str) -> float:
+        served, total = self._counts.get(view, (0, 0))
+        return served / total if total else 0.0
+
+    def _record(self, view: str, result: str):
+        CACHE_REQUESTS.labels(view, result).inc()
+        with self._lock:
+            counts = self._counts[view]
+            counts[0] += result != "miss"
+            counts[1] += 1
+
+    def _get(self, key: str, etag: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key: str, etag: str, body: bytes, mimetype: str):
+        with self._lock:
+            self._entries[key] = (etag, body, mimetype)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _not_modified(etag: str, last_modified: Optional[datetime.datetime]) -> bool:
+        # If-None-Match точнее и важнее If-Modified-Since (RFC 9110)
+        if request.if_none_match:
+            return request.if_none_match.contains(etag)
+        if request.if_modified_since and last_modified:
+            return last_modified <= request.if_modified_since
+        return False
+
+    def view(self, *datasets: str):
+        """Декоратор асинхронного маршрута, страница которого зависит от наборов данных datasets."""
+        def decorator(func):
+            name = func.__name__
+            self._counts[name] = [0, 0]
+            CACHE_HIT_RATIO.set_function(functools.partial(self.hit_ratio, name), name)
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if request.method != "GET":
+                    return await func(*args, **kwargs)
+
+                versions = await self.get_db().get_data_versions(datasets)
+                key = request.full_path
+                fingerprint = "|".join(
+                    [key, _TEMPLATES_STAMP] + [f"{ds}:{versions.get(ds, (0, None))[0]}" for ds in datasets]
+                )
+                etag = hashlib.blake2b(fingerprint.encode("utf-8"), digest_size=12).hexdigest()
+                last_modified = _to_utc(max(
+                    (updated_at for _, updated_at in versions.values() if updated_at), default=None
+                ))
+
+                if self._not_modified(etag, last_modified):
+                    self._record(name, "not_modified")
+                    response = Response(status=304)
+                else:
+                    cached = self._get(key, etag)
+                    if cached is not None:
+                        self._record(name, "hit")
+                        response = Response(cached[1], mimetype=cached[2])
+                    else:
+                        self._record(name, "miss")
+                        response = make_response(await func(*args, **kwargs))
+                        if response.status_code == 200 and not response.is_streamed:
+                            self._put(key, etag, response.get_data(), response.mimetype)
+
+                response.set_etag(etag)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                # Браузер хранит страницу, но перед показом всегда сверяет ETag
+                response.headers["Cache-Control"] = "no-cache"
+                return response
+
+            return wrapper
+        return decorator
@@ -0,0 +1,167 @@
+"""Демон приёма сообщений: Telethon, запись в БД и фоновое обслуживание без веб-панели.
+
+Запуск из корня проекта:
+    python -m tg_listener.daemon
+
+Панель (python -m tg_listener.web) сообщает демону об изменениях каналов
+и спрашивает его состояние через локальный IPC (tg_listener/ipc.py).
+"""
+import asyncio
+import os
+import signal
+import sys
+import time
+from dotenv import load_dotenv
+from tg_listener.archive import Archiver
+from tg_listener.db import Database
+from tg_listener.events import CHANNEL_REMOVED, ChannelEvent, channel_events
+from tg_listener.ipc import IPCServer
+from tg_listener.shards import make_listener
+from tg_listener import metrics
+
+load_dotenv()
+
+# Изменения каналов приходят событиями; периодическая сверка с БД — только страховка
+CHANNELS_RECONCILE_INTERVAL = int(os.getenv("CHANNELS_RECONCILE_INTERVAL", "900"))
+STATS_RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL", "3600"))
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "86400"))
+
+
+async def update_channels_periodically(listener, interval=CHANNELS_RECONCILE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await listener.update_monitored_channels()
+        except Exception as e:
+            print(f"⚠️ Ошибка сверки каналов: {e}")
+
+
+async def reconcile_stats_periodically(db, interval=STATS_RECONCILE_INTERVAL):
+    """Страховка от расхождения инкрементальных счётчиков с данными."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            drifted = await db.reconcile_stats()
+            if drifted:
+                print(f"📊 Счётчики статистики пересчитаны, исправлено каналов: {drifted}")
+        except Exception as e:
+            print(f"⚠️ Ошибка пересчёта статистики: {e}")
+
+
+async def archive_periodically(archiver, interval=RETENTION_INTERVAL):
+    """Раз в interval секунд переносит старые сводные сообщения в архив."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await archiver.run()
+        except Exception as e:
+            print(f"⚠️ Ошибка архивации: {e}")
+
+
+async def ensure_partitions_periodically(db, interval=STATS_RECONCILE_INTERVAL):
+    """PostgreSQL: заранее создаёт месячные секции messages."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            created = await db.ensure_partitions()
+            if created:
+                print(f"🗂️ Созданы секции messages: {created}")
+        except Exception as e:
+            print(f"⚠️ Ошибка создания секций: {e}")
+
+
+class IngestionDaemon:
+    """Листенер и фоновые задачи, которые пишут в БД; работает в одном процессе."""
+
+    def __init__(self, db: Database, archiver: Archiver = None):
+        self.db = db
+        # Одна сессия Telegram или пул шардов по TG_SESSION_NAMES
+        self.listener = make_listener(db)
+        self.archiver = archiver or Archiver(db)
+        self.started_at = time.time()
+        self._tasks = []
+
+    async def start(self):
+        self._tasks = [
+            asyncio.create_task(self.listener.start()),
+            asyncio.create_task(update_channels_periodically(self.listener)),
+            asyncio.create_task(reconcile_stats_periodically(self.db)),
+            asyncio.create_task(archive_periodically(self.archiver)),
+        ]
+        if self.db.dialect == "postgresql":
+            self._tasks.append(asyncio.create_task(ensure_partitions_periodically(self.db)))
+
+    async def stop(self):
+        """Дописывает буфер сообщений в БД, отключается от Telegram и гасит фоновые задачи."""
+        await self.listener.stop()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def health(self) -> dict:
+        listener_task = self._tasks[0] if self._tasks else None
+        return {
+            "ok": listener_task is not None and not listener_task.done(),
+            "pid": os.getpid(),
+            "uptime": time.time() - self.started_at,
+            "telegram_connected": self.listener.is_connected(),
+            "monitored_channels": len(self.listener.monitored_usernames),
+            "shards": self.listener.shard_health(),
+            "ingest": self.listener.ingest.stats(),
+        }
+
+    async def handle_ipc(self, message: dict) -> dict:
+        cmd = message.get("cmd")
+        if cmd == "health":
+            return self.health()
+        if cmd == "channel_event":
+            # Через процесс передаётся только id: актуальную запись читаем из общей БД
+            channel_id = int(message["channel_id"])
+            channel = None
+            if message.get("kind") != CHANNEL_REMOVED:
+                channel = await self.db.get_channel_by_id(channel_id)
+            channel_events.publish(ChannelEvent(message.get("kind"), channel_id, channel))
+            return {"ok": True}
+        if cmd == "metrics":
+            return {"ok": True, "text": metrics.render()}
+        if cmd == "reload_channels":
+            await self.listener.update_monitored_channels()
+            return {"ok": True, "monitored_channels": len(self.listener.monitored_usernames)}
+        return {"ok": False, "error": f"неизвестная команда: {cmd}"}
+
+
+async def main():
+    db = Database()
+    await db.init_db()
+
+    daemon = IngestionDaemon(db)
+    ipc = IPCServer(daemon.handle_ipc)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await daemon.start()
+    await ipc.start()
+    print("📢 Демон приёма сообщений запущен")
+
+    # Останавливаемся по сигналу или если листенер завершился сам (например, ошибка авторизации)
+    listener_task = daemon._tasks[0]
+    stopper = asyncio.create_task(stop.wait())
+    await asyncio.wait({stopper, listener_task}, return_when=asyncio.FIRST_COMPLETED)
+    stopper.cancel()
+    failed = not stop.is_set()
+
+    print("🛑 Останавливаем демон: дописываем буфер сообщений...")
+    await ipc.close()
+    await daemon.stop()
+    await db.engine.dispose()
+    print("✅ Демон остановлен")
+    # Ненулевой код — сигнал супервизору перезапустить демон
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
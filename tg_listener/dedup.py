@@ -0,0 +1,160 @@
+import hashlib
+import os
+import re
+from collections import deque
+from typing import Optional
+
+# Максимальное расстояние Хэмминга между SimHash-подписями почти одинаковых текстов
+MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "7"))
+# Сколько последних подписей каждого канала держать в памяти
+WINDOW = int(os.getenv("DEDUP_WINDOW", "2000"))
+# Искать повторы и между каналами (перепосты), а не только внутри канала
+CROSS_CHANNEL = os.getenv("DEDUP_CROSS_CHANNEL", "1") == "1"
+# Короткие сообщения не сравниваются: у них слишком много случайных совпадений
+MIN_LENGTH = int(os.getenv("DEDUP_MIN_LENGTH", "80"))
+
+SIMHASH_BITS = 64
+# Та же оценка, что и в чанкере бота: ~3 символа на токен
+CHARS_PER_TOKEN = 3.0
+
+_WORD = re.compile(r"\w+")
+_URL = re.compile(r"https?://\S+")
+
+
+def _features(text: str) -> list[str]:
+    words = _WORD.findall(_URL.sub(" ", text.lower().replace("ё", "е")))
+    if len(words) < 2:
+        return words
+    # Пары соседних слов лучше отделяют разные новости, чем отдельные слова,
+    # и меньше реагируют на мелкие правки, чем длинные шинглы
+    return [f"{words[i]} {words[i + 1]}" for i in range(len(words) - 1)]
+
+
+def simhash(text: str) -> int:
+    """64-битная SimHash-подпись текста."""
+    weights = [0] * SIMHASH_BITS
+    for feature in _features(text):
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    result = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            result |= 1 << bit
+    return result
+
+
+def to_signed(value: int) -> int:
+    """Подпись для хранения в знаковой 64-битной колонке SQLite."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class DuplicateIndex:
+    """LSH-индекс SimHash-подписей по скользящему окну последних сообщений.
+
+    Подпись делится на max_distance + 1 полос: у двух подписей с расстоянием
+    не больше max_distance хотя бы одна полоса совпадает целиком, поэтому
+    кандидатов достаточно искать в корзинах по полосам.
+    """
+
+    def __init__(self, max_distance: int = MAX_DISTANCE, window: int = WINDOW,
+                 cross_channel: bool = CROSS_CHANNEL, min_length: int = MIN_LENGTH):
+        self.max_distance = max_distance
+        self.window = window
+        self.cross_channel = cross_channel
+        self.min_length = min_length
+
+        self.bands = max_distance + 1
+        self.band_bits = SIMHASH_BITS // self.bands
+        self._band_mask = (1 << self.band_bits) - 1
+        self._buckets = {}   # (номер полосы, значение полосы) -> {(channel_id, signature): счётчик}
+        self._windows = {}   # channel_id -> deque подписей
+
+        # Статистика
+        self.checked = 0
+        self.duplicates = 0
+        self.bytes_saved = 0
+        self.tokens_saved = 0
+
+    def _band_keys(self, signature: int):
+        for band in range(self.bands):
+            yield band, signature >> (band * self.band_bits) & self._band_mask
+
+    def find(self, channel_id: int, signature: int) -> Optional[tuple]:
+        """Ищет в окне похожую подпись. Возвращает (channel_id, signature) или None."""
+        for key in self._band_keys(signature):
+            for candidate in self._buckets.get(key, ()):
+                candidate_channel, candidate_signature = candidate
+                if not self.cross_channel and candidate_channel != channel_id:
+                    continue
+                if bin(candidate_signature ^ signature).count("1") <= self.max_distance:
+                    return candidate
+        return None
+
+    def add(self, channel_id: int, signature: int):
+        window = self._windows.setdefault(channel_id, deque())
+        window.append(signature)
+        entry = (channel_id, signature)
+        for key in self._band_keys(signature):
+            bucket = self._buckets.setdefault(key, {})
+            bucket[entry] = bucket.get(entry, 0) + 1
+        if len(window) > self.window:
+            self._remove(channel_id, window.popleft())
+
+    def _remove(self, channel_id: int, signature: int):
+        entry = (channel_id, signature)
+        for key in self._band_keys(signature):
+            bucket = self._buckets.get(key)
+            if not bucket or entry not in bucket:
+                continue
+            bucket[entry] -= 1
+            if not bucket[entry]:
+                del bucket[entry]
+            if not bucket:
+                del self._buckets[key]
+
+    def signature(self, text: str) -> Optional[int]:
+        """Подпись текста или None для коротких текстов. Не трогает индекс — можно звать из другого потока."""
+        if not text or len(text) < self.min_length:
+            return None
+        return simhash(text)
+
+    def check(self, channel_id: int, text: str) -> tuple[Optional[int], bool]:
+        """Считает подпись текста и проверяет его на повтор.
+
+        Возвращает (подпись или None для коротких текстов, является ли повтором).
+        Новая подпись добавляется в окно канала.
+        """
+        signature = self.signature(text)
+        return signature, self.check_signature(channel_id, text, signature)
+
+    def check_signature(self, channel_id: int, text: str, signature: Optional[int]) -> bool:
+        """То же, что check, для заранее посчитанной подписи."""
+        if signature is None:
+            return False
+        self.checked += 1
+        duplicate = self.find(channel_id, signature) is not None
+        if duplicate:
+            self.duplicates += 1
+            self.bytes_saved += len(text.encode("utf-8"))
+            self.tokens_saved += int(len(text) / CHARS_PER_TOKEN) + 1
+        self.add(channel_id, signature)
+        return duplicate
+
+    def warm(self, rows):
+        """Заполняет окно подписями уже сохранённых сообщений: [(channel_id, signature), ...]."""
+        for channel_id, signature in rows:
+            if signature is not None:
+                self.add(channel_id, to_unsigned(signature))
+
+    def stats(self) -> dict:
+        return {
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "bytes_saved": self.bytes_saved,
+            "tokens_saved": self.tokens_saved,
+        }
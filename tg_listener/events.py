@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+# Виды событий об изменении каналов
+CHANNEL_ADDED = "added"
+CHANNEL_TOGGLED = "toggled"
+CHANNEL_REMOVED = "removed"
+
+
+class ChannelEvent:
+    """Изменение канала: kind — вид события, channel — актуальная запись (None при удалении)."""
+
+    def __init__(self, kind: str, channel_id: int, channel=None):
+        self.kind = kind
+        self.channel_id = channel_id
+        self.channel = channel
+
+    def __repr__(self):
+        return f"ChannelEvent({self.kind}, {self.channel_id})"
+
+
+class EventBus:
+    """Шина уведомлений об изменениях внутри процесса.
+
+    Подписчик получает собственную очередь в своём цикле событий.
+    publish() потокобезопасен: async-маршруты Flask выполняются в другом потоке
+    и цикле событий, поэтому событие передаётся через call_soon_threadsafe.
+    """
+
+    def __init__(self):
+        self._subscribers = []  # (цикл событий, очередь)
+        self._sinks = []  # синхронные обработчики, например пересылка в другой процесс
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers = [(loop, q) for loop, q in self._subscribers if q is not queue]
+
+    def add_sink(self, callback):
+        """callback(event) вызывается в потоке того, кто публикует событие."""
+        with self._lock:
+            # Модуль, регистрирующий обработчик, может быть импортирован дважды (__main__ и по имени)
+            if callback not in self._sinks:
+                self._sinks.append(callback)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            sinks = list(self._sinks)
+        self.published += 1
+        for callback in sinks:
+            callback(event)
+        for loop, queue in subscribers:
+            if loop.is_closed():
+                continue
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                queue.put_nowait(event)
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+
+
+# Общая шина процесса: маршруты панели публикуют, листенер слушает
+channel_events = EventBus()
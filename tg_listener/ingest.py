@@ -0,0 +1,229 @@
+import asyncio
+import time
+from collections import OrderedDict
+from tg_listener.db import msk_now
+from tg_listener.dedup import to_signed
+from tg_listener.metrics import SIZE_BUCKETS, Counter, Gauge, Histogram
+
+# Маркер остановки фонового flusher'а
+_STOP = object()
+
+QUEUE_DEPTH = Gauge("tg_listener_ingest_queue_depth", "Сообщений в очереди на запись в БД")
+DB_WRITE_SECONDS = Histogram("tg_listener_db_write_seconds", "Время записи пачки сообщений в БД")
+DB_BATCH_SIZE = Histogram("tg_listener_db_batch_size", "Размер пачки при записи в БД", buckets=SIZE_BUCKETS)
+MESSAGES_WRITTEN = Counter("tg_listener_messages_written_total", "Сообщений записано в БД")
+MESSAGES_LOST = Counter("tg_listener_messages_lost_total", "Сообщений потеряно после всех повторов записи")
+DB_WRITE_ERRORS = Counter("tg_listener_db_write_errors_total", "Неудачных попыток записи пачки")
+DUPLICATES = Counter(
+    "tg_listener_duplicates_total", "Найдено почти одинаковых сообщений: marked — помечены, dropped — отброшены",
+    ["action"]
+)
+
+
+class IngestionQueue:
+    """Буферизованная (write-behind) запись сообщений в БД.
+
+    Обработчик Telethon только кладёт сообщение в ограниченную очередь,
+    а фоновая задача пачками вставляет их в БД одной транзакцией —
+    как только набрался batch_size или истёк max_latency.
+    Если очередь заполнена, put() ждёт (backpressure). Подписи для поиска
+    повторов считаются там же, в фоновой задаче, пачкой в пуле потоков.
+    """
+
+    def __init__(self, db_manager, batch_size=200, max_latency=0.5, max_size=10000,
+                 report_interval=60, retries=3, dedup=None, drop_duplicates=False):
+        self.db = db_manager
+        # Индекс почти одинаковых сообщений (DuplicateIndex) или None
+        self.dedup = dedup
+        self.drop_duplicates = drop_duplicates
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.report_interval = report_interval
+        self.retries = retries
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self._task = None
+        # (chat_id, msg_id), уже прошедшие annotate(): живое сообщение и его копия
+        # из догрузки не должны считаться повтором друг друга
+        self._seen = OrderedDict()
+        self._seen_limit = 2 * max_size
+        QUEUE_DEPTH.set_function(self.queue.qsize)
+
+        # Статистика
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.dropped_duplicates = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self._window_started = time.monotonic()
+        self._window_written = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, channel_id, msg_id, sender_id, text, date=None):
+        """Ставит сообщение в очередь на запись (ждёт, если очередь заполнена)."""
+        # Считаются только живые сообщения: догрузка учитывается в BACKFILL_MESSAGES
+        self.received += 1
+        await self.queue.put(self.build_row(channel_id, msg_id, sender_id, text, date))
+
+    def build_row(self, channel_id, msg_id, sender_id, text, date=None):
+        """Строка для вставки в messages; подпись и признак повтора заполняет annotate()."""
+        return {
+            "msg_id": msg_id,
+            "chat_id": channel_id,
+            "sender": str(sender_id),
+            "text": text or "[Медиа или пустое сообщение]",
+            "date": date or msk_now(),
+            "is_summarized": False,
+            "simhash": None,
+            "is_duplicate": False,
+        }
+
+    def _claim(self, row) -> bool:
+        """Отмечает сообщение как обработанное; False, если оно уже встречалось."""
+        key = (row["chat_id"], row["msg_id"])
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        if len(self._seen) > self._seen_limit:
+            self._seen.popitem(last=False)
+        return True
+
+    def release(self, rows):
+        """Снимает отметку с не записанных строк: их можно будет принять снова."""
+        for row in rows:
+            self._seen.pop((row["chat_id"], row["msg_id"]), None)
+
+    async def annotate(self, rows: list) -> list:
+        """Проверяет пачку строк на повторы; в режиме drop_duplicates повторы убираются.
+
+        SimHash считается в пуле потоков, чтобы не задерживать цикл событий, а сам
+        индекс обновляется уже в цикле событий — по порядку строк. Строка с уже
+        обработанным (chat_id, msg_id) убирается без проверки: это то же самое
+        сообщение, пришедшее и вживую, и из догрузки.
+        """
+        if self.dedup is None or not rows:
+            return [row for row in rows if self._claim(row)]
+        signatures = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [self.dedup.signature(row["text"]) for row in rows]
+        )
+        kept = []
+        for row, signature in zip(rows, signatures):
+            if not self._claim(row):
+                continue
+            duplicate = self.dedup.check_signature(row["chat_id"], row["text"], signature)
+            if duplicate:
+                DUPLICATES.labels("dropped" if self.drop_duplicates else "marked").inc()
+            if duplicate and self.drop_duplicates:
+                self.dropped_duplicates += 1
+                continue
+            row["simhash"] = to_signed(signature) if signature is not None else None
+            row["is_duplicate"] = duplicate
+            kept.append(row)
+        return kept
+
+    async def close(self):
+        """Дописывает всё, что осталось в очереди, и останавливает flusher."""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        if not task.done():
+            await self.queue.put(_STOP)
+            await task
+        self._report()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            stop = False
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            batch = await self.annotate(batch)
+            if batch:
+                await self._flush(batch)
+            if stop:
+                return
+
+    async def _flush(self, batch):
+        started = time.perf_counter()
+        for attempt in range(1, self.retries + 1):
+            try:
+                await self.db.save_messages(batch)
+                break
+            except Exception as e:
+                DB_WRITE_ERRORS.inc()
+                print(f"⚠️ Ошибка записи пачки из {len(batch)} сообщений (попытка {attempt}): {e}")
+                if attempt == self.retries:
+                    self.dropped += len(batch)
+                    MESSAGES_LOST.inc(len(batch))
+                    self.release(batch)
+                    return
+                await asyncio.sleep(0.5 * attempt)
+
+        elapsed = time.perf_counter() - started
+        DB_WRITE_SECONDS.observe(elapsed)
+        DB_BATCH_SIZE.observe(len(batch))
+        MESSAGES_WRITTEN.inc(len(batch))
+
+        elapsed_ms = elapsed * 1000
+        self.flushes += 1
+        self.written += len(batch)
+        self._window_written += len(batch)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+
+        if time.monotonic() - self._window_started >= self.report_interval:
+            self._report()
+
+    def stats(self) -> dict:
+        window = max(time.monotonic() - self._window_started, 1e-9)
+        return {
+            "received": self.received,
+            "written": self.written,
+            "dropped": self.dropped,
+            "dropped_duplicates": self.dropped_duplicates,
+            "queued": self.queue.qsize(),
+            "flushes": self.flushes,
+            "messages_per_sec": self._window_written / window,
+            "last_flush_ms": self.last_flush_ms,
+            "avg_flush_ms": self._total_flush_ms / self.flushes if self.flushes else 0.0,
+            "max_flush_ms": self.max_flush_ms,
+        }
+
+    def _report(self):
+        s = self.stats()
+        print(
+            f"📥 Запись в БД: {s['messages_per_sec']:.1f} сообщ./с, "
+            f"записано {s['written']}, в очереди {s['queued']}, потеряно {s['dropped']}, "
+            f"flush avg {s['avg_flush_ms']:.1f} мс / max {s['max_flush_ms']:.1f} мс"
+        )
+        if self.dedup is not None:
+            d = self.dedup.stats()
+            print(
+                f"🧬 Повторы: {d['duplicates']} из {d['checked']}, "
+                f"сэкономлено {d['bytes_saved']} байт / ~{d['tokens_saved']} токенов"
+            )
+        self._window_started = time.monotonic()
+        self._window_written = 0
@@ -0,0 +1,107 @@
+"""Локальный канал связи между процессами: JSON-строки поверх TCP на 127.0.0.1.
+
+Демон приёма сообщений слушает порт IPC_PORT; веб-панель отправляет ему
+изменения каналов и спрашивает состояние. Один запрос — одна строка JSON,
+один ответ — одна строка JSON.
+"""
+import asyncio
+import json
+import os
+import socket
+from typing import Awaitable, Callable
+
+IPC_HOST = os.getenv("IPC_HOST", "127.0.0.1")
+IPC_PORT = int(os.getenv("IPC_PORT", "5070"))
+# Одна строка запроса не может быть больше этого (защита от мусора на порту)
+MAX_LINE = 64 * 1024
+
+
+class IPCError(Exception):
+    pass
+
+
+class IPCServer:
+    """Принимает запросы {"cmd": ..., ...} и отвечает результатом handler(message)."""
+
+    def __init__(self, handler: Callable[[dict], Awaitable[dict]], host: str = IPC_HOST, port: int = IPC_PORT):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self._server = None
+        self._clients = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve_client, self.host, self.port, limit=MAX_LINE)
+        print(f"🔌 IPC: {self.host}:{self.port}")
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._clients):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break
+                if not line:
+                    break
+                try:
+                    response = await self.handler(json.loads(line))
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(response, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+
+async def request(message: dict, host: str = IPC_HOST, port: int = IPC_PORT, timeout: float = 2.0) -> dict:
+    """Отправляет запрос демону и возвращает ответ; IPCError, если демон недоступен."""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        raise IPCError(f"демон недоступен: {e}")
+    try:
+        writer.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        raise IPCError(f"нет ответа демона: {e}")
+    finally:
+        writer.close()
+    if not line:
+        raise IPCError("демон закрыл соединение")
+    return json.loads(line)
+
+
+def request_sync(message: dict, host: str = IPC_HOST, port: int = IPC_PORT, timeout: float = 1.0) -> dict:
+    """Блокирующий вариант request() — для вызова из любого потока (например, из маршрута Flask)."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.sendall(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline(MAX_LINE)
+    except OSError as e:
+        raise IPCError(f"демон недоступен: {e}")
+    if not line:
+        raise IPCError("демон закрыл соединение")
+    return json.loads(line)
+
+
+def forward_channel_event(event):
+    """Пересылает изменение канала демону; если он недоступен, изменение подхватит сверка."""
+    try:
+        request_sync({"cmd": "channel_event", "kind": event.kind, "channel_id": event.channel_id})
+    except IPCError as e:
+        print(f"⚠️ Не удалось уведомить демон об изменении канала {event.channel_id}: {e}")
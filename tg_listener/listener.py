@@ -1,7 +1,16 @@
+import asyncio
 import os
-from telethon import TelegramClient, events
+import time
+from telethon import TelegramClient, errors, events, utils
+from telethon.tl.functions.channels import JoinChannelRequest
 from pathlib import Path
 from dotenv import load_dotenv
+from tg_listener.ingest import IngestionQueue
+from tg_listener.backfill import CatchUp
+from tg_listener.db import to_msk
+from tg_listener.dedup import DuplicateIndex
+from tg_listener.events import CHANNEL_REMOVED, channel_events
+from tg_listener.metrics import Counter, Histogram
 
 # Находим путь к папке, где лежит этот файл (tg_listener)
 current_file_path = Path(__file__).resolve()
@@ -14,69 +23,294 @@ env_path = project_root / '.env'
 
 load_dotenv(dotenv_path=env_path)
 
+EVENTS = Counter(
+    "tg_listener_events_total",
+    "События NewMessage по результату: kept, foreign, ignored, error",
+    ["result"]
+)
+HANDLER_SECONDS = Histogram("tg_listener_handler_seconds", "Время обработки события NewMessage")
+
+
+def build_ingestion_queue(db_manager) -> IngestionQueue:
+    """Буферизованная запись сообщений в БД с настройками из .env."""
+    # Повторы и перепосты помечаются (DEDUP_MODE=mark) или не сохраняются вовсе (drop)
+    dedup_mode = os.getenv("DEDUP_MODE", "mark")
+    return IngestionQueue(
+        db_manager,
+        batch_size=int(os.getenv("INGEST_BATCH_SIZE", "200")),
+        max_latency=float(os.getenv("INGEST_MAX_LATENCY", "0.5")),
+        max_size=int(os.getenv("INGEST_QUEUE_SIZE", "10000")),
+        dedup=DuplicateIndex() if dedup_mode != "off" else None,
+        drop_duplicates=dedup_mode == "drop",
+    )
+
 
 class TelegramListener:
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, session_name=None, ingest=None, owns=None, auto_join=False):
+        """session_name — сессия Telethon (по умолчанию TG_SESSION_NAME);
+        ingest — общая очередь записи, если листенер работает шардом пула;
+        owns(channel) — отбирает каналы, которые слушает этот листенер;
+        auto_join — вступать в назначенные каналы, чтобы получать их обновления.
+        """
         self.db = db_manager
         self.monitored_usernames = set()
+        self.monitored_chats = {}  # числовой id чата в Telegram -> Channel
+        self._channels = {}  # id канала в БД -> Channel
         self.is_running = False
+        self._events_task = None
+        self._catch_up_task = None
+        self._stopping = False
+        self.owns = owns or (lambda channel: True)
+        self.auto_join = auto_join
+        self._joined = None  # числовые id каналов, в которых состоит аккаунт
+
+        # Когда пришло последнее событие и насколько оно отстало от публикации
+        self.last_event_at = None
+        self.lag = None
 
         # Получаем данные из .env
         api_id = os.getenv("TG_API_ID")
         api_hash = os.getenv("TG_API_HASH")
-        session_name = os.getenv("TG_SESSION_NAME", "tg_listener")
+        self.session_name = session_name or os.getenv("TG_SESSION_NAME", "tg_listener")
 
         if not api_id or not api_hash:
             raise ValueError("❌ Ошибка: TG_API_ID или TG_API_HASH не найдены в .env!")
 
-        self.client = TelegramClient(session_name, int(api_id), api_hash)
+        self.client = TelegramClient(self.session_name, int(api_id), api_hash)
+
+        # Буферизованная запись сообщений в БД; очередь пула запускает и закрывает сам пул
+        self._owns_ingest = ingest is None
+        self.ingest = ingest or build_ingestion_queue(db_manager)
+        self.dedup = self.ingest.dedup
+
+        # Догрузка сообщений, пропущенных за время простоя
+        self.catch_up = CatchUp(self)
 
     async def update_monitored_channels(self):
-        """Обновляем список отслеживаемых каналов из БД."""
-        channels = await self.db.get_monitored_channels()
-        self.monitored_usernames = {ch.username.lower() for ch in channels}
-        print(f"🔄 Отслеживаемые каналы обновлены: {self.monitored_usernames}")
+        """Сверяет фильтр с БД (страховка: обычно изменения приходят событиями)."""
+        channels = [ch for ch in await self.db.get_monitored_channels() if self.owns(ch)]
+        monitored_ids = {ch.id for ch in channels}
+        changed = False
+
+        for channel_id in list(self._channels):
+            if channel_id not in monitored_ids:
+                changed |= self._remove_channel(channel_id)
+        for ch in channels:
+            changed |= await self._add_channel(ch)
+
+        if changed:
+            print(f"🔄 Отслеживаемые каналы обновлены: {self.monitored_usernames}")
+
+    async def _add_channel(self, channel) -> bool:
+        """Добавляет канал в фильтр; возвращает True, если фильтр изменился."""
+        current = self._channels.get(channel.id)
+        if (current is not None and current.username == channel.username
+                and current.chat_id in self.monitored_chats):
+            return False
+        if current is not None:
+            self._remove_channel(channel.id)
+
+        chat_id = channel.chat_id or await self.resolve_chat_id(channel)
+        if chat_id:
+            self.monitored_chats[chat_id] = channel
+            if self.auto_join:
+                await self._ensure_joined(channel, chat_id)
+        self._channels[channel.id] = channel
+        self.monitored_usernames.add(channel.username.lower())
+        return True
+
+    def _remove_channel(self, channel_id: int) -> bool:
+        """Убирает канал из фильтра; возвращает True, если он там был."""
+        channel = self._channels.pop(channel_id, None)
+        if channel is None:
+            return False
+        if self.monitored_chats.get(channel.chat_id) is channel:
+            del self.monitored_chats[channel.chat_id]
+        self.monitored_usernames.discard(channel.username.lower())
+        return True
+
+    async def apply_channel_event(self, event):
+        """Применяет изменение канала к фильтру без перечитывания всего списка."""
+        known = event.channel or self._channels.get(event.channel_id)
+        if (event.kind == CHANNEL_REMOVED or event.channel is None or not event.channel.is_monitored
+                or not self.owns(event.channel)):
+            changed = self._remove_channel(event.channel_id)
+            action = "убран из мониторинга"
+        else:
+            changed = await self._add_channel(event.channel)
+            action = "добавлен в мониторинг"
+        if changed:
+            print(f"🔄 Канал @{known.username} {action}")
+
+    async def _consume_channel_events(self, queue):
+        while True:
+            event = await queue.get()
+            try:
+                await self.apply_channel_event(event)
+            except Exception as e:
+                print(f"⚠️ Ошибка применения события {event}: {e}")
+
+    async def resolve_chat_id(self, channel):
+        """Определяет числовой id канала в Telegram по username и сохраняет его в БД."""
+        if not self.client.is_connected():
+            return None
+        try:
+            entity = await self.client.get_entity(channel.username)
+            chat_id = utils.get_peer_id(entity)
+            await self.db.set_channel_chat_id(channel.id, chat_id)
+        except Exception as e:
+            print(f"⚠️ Не удалось определить id канала @{channel.username}: {e}")
+            return None
+        channel.chat_id = chat_id
+        return chat_id
+
+    async def _ensure_joined(self, channel, chat_id: int):
+        """Вступает в канал, если аккаунт в нём не состоит: иначе обновления канала не приходят."""
+        if not self.client.is_connected():
+            return
+        try:
+            if self._joined is None:
+                self._joined = {dialog.id async for dialog in self.client.iter_dialogs()}
+            if chat_id in self._joined:
+                return
+            await self.client(JoinChannelRequest(await self.client.get_input_entity(chat_id)))
+            self._joined.add(chat_id)
+            print(f"➕ {self.session_name}: вступили в @{channel.username}")
+        except errors.FloodWaitError as e:
+            # Пропущенное до вступления подберёт догрузка
+            print(f"⏳ {self.session_name}: вступление в @{channel.username} отложено, FloodWait {e.seconds} с")
+        except Exception as e:
+            print(f"⚠️ {self.session_name}: не удалось вступить в @{channel.username}: {e}")
+
+    def is_connected(self) -> bool:
+        return self.client.is_connected()
+
+    def monitored_channels(self) -> list:
+        """Каналы (Channel из БД), которые сейчас слушает этот листенер."""
+        return list(self._channels.values())
+
+    def channel_ids(self) -> set:
+        """id каналов в БД, которые сейчас слушает этот листенер."""
+        return set(self._channels)
+
+    def health(self) -> dict:
+        """Состояние листенера: связь, число каналов и отставание последнего события."""
+        return {
+            "session": self.session_name,
+            "connected": self.client.is_connected(),
+            "channels": len(self._channels),
+            "last_event_ago": time.time() - self.last_event_at if self.last_event_at else None,
+            "lag_seconds": self.lag,
+        }
+
+    def shard_health(self) -> list[dict]:
+        return [self.health()]
+
+    @staticmethod
+    def is_ignored(text) -> bool:
+        return bool(text) and text.startswith("Пожалуйста, подождите")
+
+    def start_catch_up(self, last_ids: dict):
+        """Запускает догрузку пропущенного в фоне; незавершённая предыдущая отменяется."""
+        if self._catch_up_task is not None and not self._catch_up_task.done():
+            self._catch_up_task.cancel()
+        self._catch_up_task = asyncio.create_task(self.catch_up.run(last_ids))
+
+    async def handle_new_message(self, event):
+        started = time.perf_counter()
+        result = "error"
+        try:
+            # Фильтр по числовому id чата: чужие чаты отсекаются без запросов к Telegram и БД
+            channel = self.monitored_chats.get(event.chat_id)
+            if channel is None:
+                result = "foreign"
+                return
+
+            self.last_event_at = time.time()
+            if event.date:
+                self.lag = max(0.0, self.last_event_at - event.date.timestamp())
+
+            # ✅ Проверяем, начинается ли текст с "Пожалуйста, подождите"
+            text = event.text or ""
+            if self.is_ignored(text):
+                # print(f"⚠️ Сообщение из {channel.username} проигнорировано: начинается с 'Пожалуйста, подождите'")
+                result = "ignored"
+                return
+
+            # Запись в БД выполняется пачками в фоне
+            await self.ingest.put(
+                channel_id=channel.id,
+                msg_id=event.id,
+                sender_id=str(event.sender_id),
+                text=text,
+                # Дата из Telegram, как при догрузке: по ней же секционируется messages в PostgreSQL
+                date=to_msk(event.date) if event.date else None
+            )
+            result = "kept"
+        except Exception as e:
+            print(f"⚠️ Ошибка в обработчике: {e}")
+        finally:
+            EVENTS.labels(result).inc()
+            HANDLER_SECONDS.observe(time.perf_counter() - started)
 
     async def start(self):
         await self.client.start()
-        print(f"✅ Telethon клиент запущен (сессия: {os.getenv('TG_SESSION_NAME')})")
+        print(f"✅ Telethon клиент запущен (сессия: {self.session_name})")
+
+        if self._owns_ingest:
+            self.ingest.start()
+            # Окно индекса повторов заполняем подписями последних сохранённых сообщений
+            if self.dedup is not None:
+                self.dedup.warm(await self.db.get_recent_simhashes(self.dedup.window * 10))
+
+        # Подписываемся на изменения каналов до первой загрузки, чтобы не пропустить события
+        events_queue = channel_events.subscribe()
+        self._events_task = asyncio.create_task(self._consume_channel_events(events_queue))
+
+        # Последние сохранённые msg_id снимаем до подписки на новые сообщения,
+        # иначе первое живое сообщение скроет пропуск
+        last_ids = await self.db.get_last_msg_ids()
 
         # Загружаем каналы при старте
         await self.update_monitored_channels()
+        print(f"🔄 Отслеживаемые каналы: {self.monitored_usernames}")
+
+        self.client.add_event_handler(self.handle_new_message, events.NewMessage())
+        self.start_catch_up(last_ids)
 
-        @self.client.on(events.NewMessage())
-        async def handler(event):
+        try:
+            while not self._stopping:
+                await self.client.run_until_disconnected()
+                if self._stopping:
+                    break
+                print("⚠️ Соединение с Telegram потеряно, переподключаемся...")
+                last_ids = await self.db.get_last_msg_ids()
+                await self._reconnect()
+                self.start_catch_up(last_ids)
+        finally:
+            channel_events.unsubscribe(events_queue)
+            self._events_task.cancel()
+            if self._catch_up_task is not None:
+                self._catch_up_task.cancel()
+            if self._owns_ingest:
+                await self.ingest.close()
+
+    async def _reconnect(self, delay: float = 5):
+        while not self._stopping:
             try:
-                chat = await event.get_chat()
-                if not hasattr(chat, 'username') or not chat.username:
+                await self.client.connect()
+                if self.client.is_connected():
+                    print("✅ Соединение с Telegram восстановлено")
                     return
-
-                if chat.username.lower() in self.monitored_usernames:
-                    # Найти канал в БД по юзернейму
-                    async with self.db.session_factory() as session:
-                        from tg_listener.db import Channel
-                        from sqlalchemy import select
-                        result = await session.execute(
-                            select(Channel).where(Channel.username == chat.username)
-                        )
-                        channel = result.scalar_one_or_none()
-                        if not channel:
-                            return
-
-                        # ✅ Проверяем, начинается ли текст с "Пожалуйста, подождите"
-                        text = event.text or ""
-                        if text.startswith("Пожалуйста, подождите"):
-                            # print(f"⚠️ Сообщение из {chat.username} проигнорировано: начинается с 'Пожалуйста, подождите'")
-                            return
-
-                        await self.db.save_message(
-                            channel_id=channel.id,
-                            msg_id=event.id,
-                            sender_id=str(event.sender_id),
-                            text=text
-                        )
-                        print(f"✅ Сообщение из {chat.username} сохранено!")
             except Exception as e:
-                print(f"⚠️ Ошибка в обработчике: {e}")
+                print(f"⚠️ Не удалось переподключиться: {e}")
+            await asyncio.sleep(delay)
 
-        await self.client.run_until_disconnected()
+    async def stop(self):
+        """Корректная остановка: дописываем буфер и отключаемся от Telegram."""
+        self._stopping = True
+        if self._catch_up_task is not None:
+            self._catch_up_task.cancel()
+        if self._owns_ingest:
+            await self.ingest.close()
+        await self.client.disconnect()
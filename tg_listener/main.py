@@ -1,13 +1,23 @@
 import asyncio
+import base64
+import datetime
+import json
 import sys
+import time
 import os
 from pathlib import Path
-from flask import Flask, render_template, request, redirect, url_for, flash
+from typing import Optional
+from flask import Flask, Response, g, render_template, request, redirect, url_for, flash, jsonify, stream_with_context
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
 from dotenv import load_dotenv
-from tg_listener.db import Database
-from tg_listener.listener import TelegramListener
+from markupsafe import Markup, escape
+from tg_listener.archive import Archiver
+from tg_listener.cache import ResponseCache
+from tg_listener.db import Database, DATA_CHANNELS, DATA_MESSAGES, DATA_SUMMARIES, FTS_MARK_START, FTS_MARK_END
+from tg_listener.events import CHANNEL_ADDED, CHANNEL_REMOVED, CHANNEL_TOGGLED, ChannelEvent, channel_events
+from tg_listener.ipc import IPCError, request as ipc_request
+from tg_listener import metrics
 import pytz
 
 load_dotenv()
@@ -21,11 +31,62 @@ sys.path.append(str(root_dir))
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY")
 db = Database()
-listener = TelegramListener(db)
+archiver = Archiver(db)
+# Демон приёма, если он работает в этом же процессе (режим «всё в одном»)
+local_daemon = None
+# Готовые страницы, пока не изменились данные, от которых они зависят
+view_cache = ResponseCache(lambda: db)
+
+HTTP_SECONDS = metrics.Histogram(
+    "tg_web_request_seconds", "Время обработки запроса панели", ["endpoint", "method", "status"]
+)
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # Метка — имя маршрута, а не URL, чтобы число рядов не зависело от параметров
+        HTTP_SECONDS.labels(request.endpoint or "unknown", request.method, response.status_code).observe(
+            time.perf_counter() - started
+        )
+    return response
+
+
+@app.route("/api/health")
+async def api_health():
+    """Состояние панели и демона приёма сообщений."""
+    if local_daemon is not None:
+        daemon = local_daemon.health()
+    else:
+        try:
+            daemon = await ipc_request({"cmd": "health"})
+        except IPCError as e:
+            daemon = {"ok": False, "error": str(e)}
+    status = 200 if daemon.get("ok") else 503
+    return jsonify({"web": {"ok": True, "pid": os.getpid()}, "daemon": daemon}), status
+
+
+@app.route("/metrics")
+async def metrics_endpoint():
+    text = metrics.render()
+    if local_daemon is None:
+        # Метрики приёма сообщений живут в процессе демона
+        try:
+            text += (await ipc_request({"cmd": "metrics"})).get("text", "")
+        except IPCError:
+            pass
+    return Response(text, content_type=metrics.CONTENT_TYPE)
 
 
 @app.route("/")
 @app.route("/channels", methods=["GET", "POST"])
+@view_cache.view(DATA_CHANNELS)
 async def channels():
     if request.method == "POST":
         # Получаем данные из формы (удаляем @ если пользователь его ввел)
@@ -33,12 +94,13 @@ async def channels():
         title = (request.form.get("title") or "").strip()
 
         if username and title:
-            await db.add_channel(username=username, title=title)
+            channel = await db.add_channel(username=username, title=title)
+            channel_events.publish(ChannelEvent(CHANNEL_ADDED, channel.id, channel))
         return redirect(url_for("channels"))
 
     # Получаем список всех каналов
     all_channels = await db.get_all_channels()
-    return render_template("channels.html", channels=all_channels)
+    return render_template("channels.html", channels=all_channels, default_retention=archiver.default_days)
 
 
 @app.route("/channels/activate/<int:channel_id>")
@@ -52,7 +114,19 @@ async def activate_channel(channel_id: int):
 async def toggle_channel(channel_id: int):
     channel = await db.get_channel_by_id(channel_id)
     if channel:
-        await db.set_channel_monitored(channel_id, not channel.is_monitored)
+        channel.is_monitored = not channel.is_monitored
+        await db.set_channel_monitored(channel_id, channel.is_monitored)
+        # Листенер применяет изменение сразу, не дожидаясь сверки
+        channel_events.publish(ChannelEvent(CHANNEL_TOGGLED, channel_id, channel))
+    return redirect(url_for("channels"))
+
+
+@app.route("/channels/retention/<int:channel_id>", methods=["POST"])
+async def set_channel_retention(channel_id: int):
+    # Пустое поле — срок по умолчанию (RETENTION_DAYS), 0 — не архивировать
+    value = (request.form.get("retention_days") or "").strip()
+    days = int(value) if value.isdigit() else None
+    await db.set_channel_retention(channel_id, days)
     return redirect(url_for("channels"))
 
 
@@ -60,82 +134,295 @@ async def toggle_channel(channel_id: int):
 async def delete_channel(channel_id: int):
     deleted = await db.delete_channel(channel_id)
     if deleted:
+        channel_events.publish(ChannelEvent(CHANNEL_REMOVED, channel_id))
         flash("Канал успешно удалён.", "success")
     else:
         flash("Канал не найден.", "error")
     return redirect(url_for("channels"))
 
 
-@app.route("/messages")
-async def messages():
-    async with db.session_factory() as session:
-        from sqlalchemy import select
-        from tg_listener.db import Message, Channel
-
-        # Получаем все прослушиваемые каналы
-        monitored_channels = await db.get_monitored_channels()
-        channel_ids = [ch.id for ch in monitored_channels]
-
-        if not channel_ids:
-            return render_template("messages.html", messages=[], total_count=0)
-
-        # Запрос: последние 20 сообщений из прослушиваемых каналов
-        stmt = (
-            select(Message)
-            .where(Message.chat_id.in_(channel_ids))
-            .order_by(Message.date.desc())
-            .limit(20)
-        )
-        result = await session.execute(stmt)
-        messages = result.scalars().all()
+# Максимальный размер страницы для /messages, /summary и JSON API
+PAGE_SIZE_MAX = 100
 
-        total_count = len(messages)  # Можно сделать отдельным запросом, если нужно точное общее количество
 
-    return render_template("messages.html", messages=messages, total_count=total_count)
+def encode_cursor(date: datetime.datetime, row_id: int) -> str:
+    raw = f"{date.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
 
-@app.route("/summary")
-async def summary():
-    async with db.session_factory() as session:
-        from sqlalchemy import select
-        from tg_listener.db import Summary, Channel
-        import pytz
-
-        stmt = (
-            select(Summary, Channel)
-            .join(Channel, Summary.channel_id == Channel.id)
-            .order_by(Summary.created_at.desc())
-            .limit(30)
+def decode_cursor(cursor: Optional[str]):
+    """Курсор страницы -> (date, id) или None, если курсора нет или он испорчен."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        date_str, row_id = raw.rsplit("|", 1)
+        return datetime.datetime.fromisoformat(date_str), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def parse_date(value: Optional[str], end_of_day: bool = False):
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # Для даты без времени граница "по" включает весь день
+    if end_of_day and len(value) == 10:
+        parsed += datetime.timedelta(days=1)
+    return parsed
+
+
+def page_filters(default_limit: int) -> dict:
+    args = request.args
+    limit = args.get("limit", default_limit, type=int)
+    return {
+        "channel": args.get("channel", type=int),
+        "start": parse_date(args.get("from")),
+        "end": parse_date(args.get("to"), end_of_day=True),
+        "summarized": {"1": True, "0": False}.get(args.get("summarized", "")),
+        "before": decode_cursor(args.get("cursor")),
+        "limit": min(max(limit, 1), PAGE_SIZE_MAX),
+    }
+
+
+def filter_query() -> dict:
+    """Текущие фильтры из строки запроса — для ссылок на следующую страницу."""
+    return {k: v for k, v in request.args.items() if k != "cursor" and v}
+
+
+async def load_messages_page():
+    filters = page_filters(20)
+    all_channels = await db.get_all_channels()
+    if filters["channel"]:
+        channel_ids = [filters["channel"]]
+    else:
+        # По умолчанию — все прослушиваемые каналы
+        channel_ids = [ch.id for ch in all_channels if ch.is_monitored]
+
+    rows = []
+    if channel_ids:
+        rows = await db.get_messages_page(
+            channel_ids, before=filters["before"], start=filters["start"], end=filters["end"],
+            summarized=filters["summarized"], limit=filters["limit"]
         )
-        result = await session.execute(stmt)
-        rows = result.all()
 
-        # Конвертируем время в МСК
-        # tz_msk = pytz.timezone('Europe/Moscow')
-        converted_rows = []
-        for summary, ch in rows:
-            if summary.created_at:
-                # summary.created_at = summary.created_at.replace(tzinfo=pytz.utc).astimezone(tz_msk)
-                summary.created_at = summary.created_at.replace(tzinfo=pytz.utc)
-            converted_rows.append((summary, ch))
+    next_cursor = None
+    if len(rows) > filters["limit"]:
+        rows = rows[:filters["limit"]]
+        next_cursor = encode_cursor(rows[-1].date, rows[-1].id)
 
-    return render_template("summary.html", rows=converted_rows)
+    total_count = 0
+    if channel_ids and (filters["start"] or filters["end"]):
+        # Счётчики каналов не знают о датах: считаем только выбранный период по индексу (chat_id, date)
+        total_count = await db.count_messages(
+            channel_ids, start=filters["start"], end=filters["end"], summarized=filters["summarized"]
+        )
+        return all_channels, rows, next_cursor, total_count
 
+    # Без периода итог берём из счётчиков каналов, а не из COUNT по таблице сообщений
+    stats = await db.get_channel_stats()
+    for channel_id in channel_ids:
+        st = stats.get(channel_id)
+        if st is None:
+            continue
+        if filters["summarized"] is None:
+            total_count += st.total
+        elif filters["summarized"]:
+            total_count += st.summarized
+        else:
+            total_count += st.total - st.summarized
 
-async def update_channels_periodically(listener, interval=60):
-    while True:
-        await asyncio.sleep(interval)
-        await listener.update_monitored_channels()
+    return all_channels, rows, next_cursor, total_count
+
+
+@app.route("/messages")
+@view_cache.view(DATA_CHANNELS, DATA_MESSAGES)
+async def messages():
+    all_channels, rows, next_cursor, total_count = await load_messages_page()
+
+    # Сообщение проанализировано, если его id не больше водяного знака канала
+    watermarks = {ch.id: ch.summary_watermark for ch in all_channels}
+    return render_template(
+        "messages.html", messages=rows, total_count=total_count, watermarks=watermarks,
+        channels=all_channels, query=filter_query(), next_cursor=next_cursor
+    )
+
+
+@app.route("/api/messages")
+@view_cache.view(DATA_CHANNELS, DATA_MESSAGES)
+async def api_messages():
+    all_channels, rows, next_cursor, total_count = await load_messages_page()
+    watermarks = {ch.id: ch.summary_watermark for ch in all_channels}
+    return jsonify({
+        "items": [
+            {
+                "id": m.id,
+                "msg_id": m.msg_id,
+                "channel_id": m.chat_id,
+                "sender": m.sender,
+                "text": m.text,
+                "date": m.date.isoformat() if m.date else None,
+                "is_summarized": m.id <= watermarks.get(m.chat_id, 0),
+            }
+            for m in rows
+        ],
+        "next_cursor": next_cursor,
+        "total": total_count,
+    })
+
+
+async def load_summaries_page():
+    filters = page_filters(30)
+    channel_ids = [filters["channel"]] if filters["channel"] else None
+    rows = await db.get_summaries_page(
+        channel_ids, before=filters["before"], start=filters["start"], end=filters["end"],
+        limit=filters["limit"]
+    )
+
+    next_cursor = None
+    if len(rows) > filters["limit"]:
+        rows = rows[:filters["limit"]]
+        last_summary = rows[-1][0]
+        next_cursor = encode_cursor(last_summary.created_at, last_summary.id)
+
+    total_count = await db.count_summaries(channel_ids, start=filters["start"], end=filters["end"])
+    return rows, next_cursor, total_count
+
+
+@app.route("/summary")
+@view_cache.view(DATA_CHANNELS, DATA_SUMMARIES)
+async def summary():
+    rows, next_cursor, total_count = await load_summaries_page()
+
+    # Конвертируем время в МСК
+    # tz_msk = pytz.timezone('Europe/Moscow')
+    converted_rows = []
+    for summary, ch in rows:
+        if summary.created_at:
+            # summary.created_at = summary.created_at.replace(tzinfo=pytz.utc).astimezone(tz_msk)
+            summary.created_at = summary.created_at.replace(tzinfo=pytz.utc)
+        converted_rows.append((summary, ch))
+
+    return render_template(
+        "summary.html", rows=converted_rows, total_count=total_count,
+        channels=await db.get_all_channels(), query=filter_query(), next_cursor=next_cursor
+    )
+
+
+@app.route("/api/summaries")
+@view_cache.view(DATA_CHANNELS, DATA_SUMMARIES)
+async def api_summaries():
+    rows, next_cursor, total_count = await load_summaries_page()
+    return jsonify({
+        "items": [
+            {
+                "id": summary.id,
+                "channel_id": ch.id,
+                "channel": ch.username,
+                "created_at": summary.created_at.isoformat() if summary.created_at else None,
+                "range_start": summary.range_start.isoformat() if summary.range_start else None,
+                "range_end": summary.range_end.isoformat() if summary.range_end else None,
+                "content": summary.content,
+            }
+            for summary, ch in rows
+        ],
+        "next_cursor": next_cursor,
+        "total": total_count,
+    })
+
+
+SEARCH_PAGE_SIZE = 20
+
+
+def render_snippet(snippet: str) -> Markup:
+    """Экранирует сниппет и подсвечивает найденные слова."""
+    return Markup(
+        str(escape(snippet or ""))
+        .replace(FTS_MARK_START, "<mark>")
+        .replace(FTS_MARK_END, "</mark>")
+    )
+
+
+def split_snippet(snippet: str) -> tuple[str, list]:
+    """Сниппет без разметки и позиции найденных слов в нём: [[начало, конец), ...]."""
+    text = []
+    highlights = []
+    length = 0
+    for i, part in enumerate((snippet or "").split(FTS_MARK_START)):
+        marked, _, rest = part.partition(FTS_MARK_END) if i else ("", "", part)
+        if marked:
+            highlights.append([length, length + len(marked)])
+        text.append(marked + rest)
+        length += len(marked) + len(rest)
+    return "".join(text), highlights
+
+
+async def run_search():
+    query = (request.args.get("q") or "").strip()
+    scope = "summaries" if request.args.get("scope") == "summaries" else "messages"
+    page = max(request.args.get("page", 1, type=int), 1)
+
+    results = []
+    if query:
+        results = await db.search(query, scope, limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE)
+    has_more = len(results) > SEARCH_PAGE_SIZE
+    return query, scope, page, results[:SEARCH_PAGE_SIZE], has_more
+
+
+@app.route("/search")
+async def search():
+    query, scope, page, results, has_more = await run_search()
+    for item in results:
+        item["snippet"] = render_snippet(item["snippet"])
+    return render_template(
+        "search.html", query=query, scope=scope, page=page, results=results, has_more=has_more
+    )
+
+
+@app.route("/api/search")
+async def api_search():
+    query, scope, page, results, has_more = await run_search()
+    for item in results:
+        item["date"] = item["date"].isoformat() if item["date"] else None
+        # Текст сообщения задан пользователем: HTML отдаём только экранированным, а для
+        # клиентов, которые рисуют подсветку сами, — чистый текст с позициями совпадений
+        snippet = item["snippet"]
+        item["snippet_html"] = str(render_snippet(snippet))
+        item["snippet"], item["highlights"] = split_snippet(snippet)
+    return jsonify({"query": query, "scope": scope, "page": page, "items": results, "has_more": has_more})
+
+
+@app.route("/api/archive/<int:channel_id>")
+def api_archive(channel_id: int):
+    """Выгрузка архивных сообщений канала за период в формате JSONL (потоком)."""
+    start = parse_date(request.args.get("from"))
+    end = parse_date(request.args.get("to"), end_of_day=True)
+    rows = archiver.iter_archived(channel_id, start, end)
+    return Response(
+        stream_with_context(json.dumps(row, ensure_ascii=False) + "\n" for row in rows),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename=channel_{channel_id}_archive.jsonl"},
+    )
 
 
 async def main():
+    """Режим «всё в одном»: демон приёма и панель в одном процессе и цикле событий.
+
+    Для нагрузки лучше запускать их отдельно: python -m tg_listener.supervisor.
+    """
+    global local_daemon
+    from tg_listener.daemon import IngestionDaemon
+
     # 1. Инициализируем базу данных (создаем таблицы в tg_monitor.db)
     await db.init_db()
 
     # 2. Запускаем фоновую задачу прослушивания Telegram
     # Используем create_task, чтобы листенер работал параллельно с сайтом
-    listener_task = asyncio.create_task(listener.start())
-    updater_task = asyncio.create_task(update_channels_periodically(listener, 60))  # <-- каждые 60 сек
+    local_daemon = IngestionDaemon(db, archiver)
+    await local_daemon.start()
 
     # 3. Конфигурация веб-сервера Hypercorn
     config = Config()
@@ -150,9 +437,8 @@ async def main():
     try:
         await serve(app, config)
     finally:
-        # При остановке сервера пробуем корректно закрыть задачу листенера
-        listener_task.cancel()
-        updater_task.cancel()
+        # При остановке сервера дописываем буфер сообщений и закрываем задачи листенера
+        await local_daemon.stop()
 
 
 if __name__ == "__main__":
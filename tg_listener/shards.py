@@ -0,0 +1,200 @@
+"""Пул листенеров: отслеживаемые каналы распределяются между несколькими сессиями Telegram.
+
+Сессии перечисляются в TG_SESSION_NAMES через запятую (каждая — отдельный
+аккаунт со своим файлом .session). Канал закрепляется за сессией
+консистентным хешированием по id канала: при добавлении или удалении сессии
+переезжает лишь около 1/N каналов, остальные остаются на своих шардах.
+Шарды работают задачами одного процесса и пишут в общую IngestionQueue.
+
+Шард, который дольше SHARD_FAILOVER_AFTER секунд не на связи (или чья задача
+завершилась), исключается из кольца, и его каналы переходят к остальным;
+когда связь восстанавливается, шард возвращается в кольцо.
+"""
+import asyncio
+import bisect
+import hashlib
+import os
+import time
+from functools import partial
+from typing import Optional, Sequence
+from tg_listener.listener import TelegramListener, build_ingestion_queue
+from tg_listener.metrics import Counter, Gauge
+
+# Точек на кольце у каждой сессии: чем больше, тем ровнее распределение
+SHARD_REPLICAS = int(os.getenv("SHARD_REPLICAS", "64"))
+SHARD_AUTO_JOIN = os.getenv("SHARD_AUTO_JOIN", "1") == "1"
+SHARD_FAILOVER_AFTER = float(os.getenv("SHARD_FAILOVER_AFTER", "300"))
+SHARD_CHECK_INTERVAL = float(os.getenv("SHARD_CHECK_INTERVAL", "10"))
+
+SHARD_CONNECTED = Gauge("tg_listener_shard_connected", "Шард на связи с Telegram (1/0)", ["shard"])
+SHARD_ACTIVE = Gauge("tg_listener_shard_active", "Шард в кольце и получает каналы (1/0)", ["shard"])
+SHARD_CHANNELS = Gauge("tg_listener_shard_channels", "Каналов закреплено за шардом", ["shard"])
+SHARD_LAG = Gauge(
+    "tg_listener_shard_lag_seconds", "Задержка последнего сообщения шарда от публикации до приёма", ["shard"]
+)
+SHARD_REBALANCES = Counter("tg_listener_shard_rebalances_total", "Перераспределений каналов между шардами")
+
+
+def session_names() -> list[str]:
+    """Сессии из TG_SESSION_NAMES; если переменная не задана — одна TG_SESSION_NAME."""
+    names = [name.strip() for name in os.getenv("TG_SESSION_NAMES", "").split(",") if name.strip()]
+    return names or [os.getenv("TG_SESSION_NAME", "tg_listener")]
+
+
+class HashRing:
+    """Консистентное хеширование: ключ -> узел, ближайший по часовой стрелке."""
+
+    def __init__(self, nodes: Sequence[str] = (), replicas: int = SHARD_REPLICAS):
+        self.replicas = replicas
+        self._points = []  # отсортированные хеши точек
+        self._owners = {}  # хеш точки -> узел
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value) -> int:
+        return int.from_bytes(hashlib.md5(str(value).encode("utf-8")).digest()[:8], "big")
+
+    @property
+    def nodes(self) -> set:
+        return set(self._owners.values())
+
+    def add(self, node: str):
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+            self._owners[point] = node
+
+    def remove(self, node: str):
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            if self._owners.get(point) == node:
+                del self._owners[point]
+                self._points.pop(bisect.bisect_left(self._points, point))
+
+    def node_for(self, key) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+class ListenerPool:
+    """Несколько TelegramListener-шардов с общей очередью записи; интерфейс как у TelegramListener."""
+
+    def __init__(self, db_manager, sessions: Sequence[str], auto_join: bool = SHARD_AUTO_JOIN):
+        self.db = db_manager
+        self.ingest = build_ingestion_queue(db_manager)
+        self.ring = HashRing(sessions)
+        self.shards = {
+            name: TelegramListener(
+                db_manager, session_name=name, ingest=self.ingest,
+                owns=partial(self._owns, name), auto_join=auto_join,
+            )
+            for name in sessions
+        }
+        self._tasks = {}
+        self._down_since = {}
+        self._stopping = False
+
+        for name, shard in self.shards.items():
+            SHARD_CONNECTED.set_function(lambda shard=shard: float(shard.client.is_connected()), name)
+            SHARD_ACTIVE.set_function(lambda name=name: float(name in self.ring.nodes), name)
+            SHARD_CHANNELS.set_function(lambda shard=shard: len(shard.channel_ids()), name)
+            SHARD_LAG.set_function(lambda shard=shard: shard.lag or 0.0, name)
+
+    def _owns(self, name: str, channel) -> bool:
+        return self.ring.node_for(channel.id) == name
+
+    @property
+    def monitored_usernames(self) -> set:
+        return set().union(*(shard.monitored_usernames for shard in self.shards.values()))
+
+    def is_connected(self) -> bool:
+        return any(shard.is_connected() for shard in self.shards.values())
+
+    def shard_health(self) -> list[dict]:
+        return [
+            {**shard.health(), "active": name in self.ring.nodes}
+            for name, shard in self.shards.items()
+        ]
+
+    async def update_monitored_channels(self):
+        await self.rebalance()
+
+    async def rebalance(self):
+        """Приводит каналы шардов к кольцу; каналы, перешедшие к шарду, он догружает из истории."""
+        last_ids = await self.db.get_last_msg_ids()
+        for shard in self.shards.values():
+            before = shard.channel_ids()
+            await shard.update_monitored_channels()
+            gained = shard.channel_ids() - before
+            if gained and shard.is_connected():
+                shard.start_catch_up({cid: last_ids[cid] for cid in gained if cid in last_ids})
+
+    async def _set_active(self, name: str, active: bool):
+        if active == (name in self.ring.nodes):
+            return
+        if active:
+            self.ring.add(name)
+            print(f"🔀 Шард {name} снова на связи, возвращается в кольцо")
+        else:
+            self.ring.remove(name)
+            print(f"🔀 Шард {name} недоступен, его каналы переходят к остальным")
+        SHARD_REBALANCES.inc()
+        await self.rebalance()
+
+    async def _check_shards(self):
+        now = time.monotonic()
+        for name, shard in self.shards.items():
+            task = self._tasks.get(name)
+            alive = task is not None and not task.done()
+            if alive and shard.is_connected():
+                self._down_since.pop(name, None)
+                await self._set_active(name, True)
+                continue
+            if name not in self._down_since and task is not None and task.done() and not task.cancelled() \
+                    and task.exception() is not None:
+                print(f"⚠️ Шард {name} завершился с ошибкой: {task.exception()}")
+            down_since = self._down_since.setdefault(name, now)
+            # Упавшая задача не вернётся; отключённому шарду даём время переподключиться
+            if not alive or now - down_since >= SHARD_FAILOVER_AFTER:
+                # Последний шард из кольца не убираем: каналам всё равно некуда переехать
+                if len(self.ring.nodes) > 1 or name not in self.ring.nodes:
+                    await self._set_active(name, False)
+
+    async def start(self):
+        """Запускает шарды и следит за ними; завершается, когда не осталось ни одного живого шарда."""
+        self.ingest.start()
+        if self.ingest.dedup is not None:
+            self.ingest.dedup.warm(await self.db.get_recent_simhashes(self.ingest.dedup.window * 10))
+
+        print(f"🧩 Пул листенеров: {len(self.shards)} сессий ({', '.join(self.shards)})")
+        self._tasks = {name: asyncio.create_task(shard.start()) for name, shard in self.shards.items()}
+        try:
+            while not self._stopping and any(not task.done() for task in self._tasks.values()):
+                await asyncio.sleep(SHARD_CHECK_INTERVAL)
+                try:
+                    await self._check_shards()
+                except Exception as e:
+                    print(f"⚠️ Ошибка проверки шардов: {e}")
+        finally:
+            for task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+            await self.ingest.close()
+
+    async def stop(self):
+        """Останавливает шарды, затем дописывает общий буфер в БД."""
+        self._stopping = True
+        await asyncio.gather(*(shard.stop() for shard in self.shards.values()), return_exceptions=True)
+        await self.ingest.close()
+
+
+def make_listener(db_manager):
+    """TelegramListener для одной сессии, ListenerPool — для нескольких из TG_SESSION_NAMES."""
+    sessions = session_names()
+    if len(sessions) == 1:
+        return TelegramListener(db_manager, session_name=sessions[0])
+    return ListenerPool(db_manager, sessions)
@@ -0,0 +1,112 @@
+"""Супервизор: запускает демон приёма и веб-панель отдельными процессами.
+
+Запуск из корня проекта:
+    python -m tg_listener.supervisor
+
+Упавший процесс перезапускается с растущей паузой. По Ctrl+C / SIGTERM сначала
+останавливается панель, затем демон, который дописывает буфер сообщений в БД;
+если он не уложился в SUPERVISOR_DRAIN_TIMEOUT, процесс завершается принудительно.
+"""
+import asyncio
+import os
+import signal
+import sys
+import time
+from dotenv import load_dotenv
+from tg_listener.ipc import IPCError, request as ipc_request
+
+load_dotenv()
+
+DRAIN_TIMEOUT = float(os.getenv("SUPERVISOR_DRAIN_TIMEOUT", "30"))
+# Сколько ждать, пока демон начнёт отвечать по IPC, прежде чем запускать панель
+STARTUP_TIMEOUT = float(os.getenv("SUPERVISOR_STARTUP_TIMEOUT", "20"))
+MAX_RESTART_DELAY = 60
+
+
+class Service:
+    """Дочерний процесс с перезапуском при падении."""
+
+    def __init__(self, name: str, module: str):
+        self.name = name
+        self.args = [sys.executable, "-m", module]
+        self.process = None
+        self.restarts = 0
+        self._stopping = False
+        self._started_at = 0.0
+
+    async def start(self):
+        # Своя группа процессов: Ctrl+C получает только супервизор и сам решает порядок остановки
+        self.process = await asyncio.create_subprocess_exec(*self.args, start_new_session=True)
+        self._started_at = time.monotonic()
+        print(f"▶️ {self.name}: запущен (pid {self.process.pid})")
+
+    async def watch(self):
+        """Ждёт завершения процесса и перезапускает его, пока не начата остановка."""
+        while not self._stopping:
+            code = await self.process.wait()
+            if self._stopping:
+                break
+            # Если процесс успел поработать, счётчик перезапусков начинается заново
+            if time.monotonic() - self._started_at > MAX_RESTART_DELAY:
+                self.restarts = 0
+            delay = min(2 ** self.restarts, MAX_RESTART_DELAY)
+            self.restarts += 1
+            print(f"⚠️ {self.name}: завершился с кодом {code}, перезапуск через {delay} с")
+            await asyncio.sleep(delay)
+            if not self._stopping:
+                await self.start()
+
+    async def stop(self, timeout: float):
+        self._stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+            print(f"⏹️ {self.name}: остановлен")
+        except asyncio.TimeoutError:
+            print(f"⚠️ {self.name}: не остановился за {timeout:.0f} с, завершаем принудительно")
+            self.process.kill()
+            await self.process.wait()
+
+
+async def wait_for_daemon(timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await ipc_request({"cmd": "health"}, timeout=1.0)
+            return True
+        except IPCError:
+            await asyncio.sleep(0.5)
+    return False
+
+
+async def main():
+    daemon = Service("демон приёма", "tg_listener.daemon")
+    web = Service("веб-панель", "tg_listener.web")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # Демон первым: он же приводит схему БД к актуальной
+    await daemon.start()
+    if not await wait_for_daemon(STARTUP_TIMEOUT):
+        print("⚠️ Демон пока не отвечает по IPC, панель запускается без него")
+    await web.start()
+
+    watchers = [asyncio.create_task(daemon.watch()), asyncio.create_task(web.watch())]
+    await stop.wait()
+
+    print("🛑 Остановка: панель, затем демон (дописывает буфер сообщений)...")
+    await web.stop(timeout=15)
+    await daemon.stop(timeout=DRAIN_TIMEOUT)
+    for watcher in watchers:
+        watcher.cancel()
+    await asyncio.gather(*watchers, return_exceptions=True)
+    print("✅ Все процессы остановлены")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+"""Веб-панель отдельным процессом, в несколько воркеров Hypercorn.
+
+Запуск из корня проекта:
+    python -m tg_listener.web
+
+Сообщения из Telegram принимает демон (python -m tg_listener.daemon); панель читает
+ту же БД SQLite (WAL допускает параллельных читателей) и пересылает демону
+изменения каналов через локальный IPC.
+"""
+import asyncio
+import os
+import sys
+from dotenv import load_dotenv
+from hypercorn.config import Config
+from hypercorn.run import run
+from tg_listener.events import channel_events
+from tg_listener.ipc import forward_channel_event
+from tg_listener.main import app, db  # noqa: F401 — app загружают воркеры Hypercorn
+
+load_dotenv()
+
+WEB_BIND = os.getenv("WEB_BIND", "127.0.0.1:5000")
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(min(os.cpu_count() or 1, 4))))
+# Сколько секунд воркер дорабатывает начатые запросы при остановке
+WEB_GRACEFUL_TIMEOUT = float(os.getenv("WEB_GRACEFUL_TIMEOUT", "10"))
+
+# Каждый воркер импортирует этот модуль: изменения каналов из маршрутов уходят демону
+channel_events.add_sink(forward_channel_event)
+
+
+async def prepare_db():
+    # Схему БД приводим к актуальной один раз, до запуска воркеров
+    await db.init_db()
+    await db.engine.dispose()
+
+
+def main():
+    asyncio.run(prepare_db())
+
+    config = Config()
+    config.application_path = "tg_listener.web:app"
+    config.bind = [WEB_BIND]
+    config.workers = WEB_WORKERS
+    config.graceful_timeout = WEB_GRACEFUL_TIMEOUT
+    config.accesslog = None
+
+    print(f"🌐 Панель управления: http://{WEB_BIND} (воркеров: {WEB_WORKERS})")
+    return run(config)
+
+
+if __name__ == "__main__":
+    sys.exit(main())